@@ -38,7 +38,8 @@ Instructions for developers:
   • Each tenant must specify their S3 bucket name and the path to their Python handler.
 - Each tenant will be deployed with:
   • A Python Lambda function for exporting analytics to their S3 bucket
-- All tenant Lambdas will be scheduled by a single EventBridge rule that triggers daily at 12MN (GMT+8).
+- A single EventBridge rule starts the nightly state machine daily at 12MN (GMT+8). It runs the ETL,
+  then each tenant's mart and export Lambda (see integreat_analytics/nightly_dag.py).
 - Integreat's own Lambda (in scripts/integreat) runs the centralized DW ETL and uploads CSVs to each tenant bucket.
 - No secrets manager is used; configuration is passed via CDK context or environment variables.
 - S3 permissions must be managed in the separate Node.js infrastructure stack.
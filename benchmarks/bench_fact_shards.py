@@ -0,0 +1,82 @@
+"""
+bench_fact_shards.py
+
+Measures how the fact load in `etl()` scales with the number of hour shards.
+
+The benchmark loads one day of the synthetic workload into
+OLTP.api_transactions on a LOCAL Postgres, then re-runs the fact load for each
+requested shard count (truncating the fact table in between) and prints
+rows/sec and speedup. The warehouse indexes are provisioned first: without
+the created_at index on the source, every hour shard scans the whole table
+and the speedup column measures N full scans instead of parallelism.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_fact_shards --rows 500000 --shards 1,2,4,8
+
+Remote hosts are refused unless --allow-remote is given, because the
+benchmark truncates OLAP.fact_log_transactions.
+"""
+
+import argparse
+import os
+import tempfile
+
+from benchmarks import harness, workload
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fact load throughput vs. shard count")
+    harness.add_database_args(parser)
+    parser.add_argument("--date", default="2024-01-15", help="day to seed and load (YYYY-MM-DD)")
+    parser.add_argument("--rows", type=int, default=200_000, help="rows to seed for the day")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per shard count (best is kept)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    shard_counts = [int(s) for s in args.shards.split(",") if s.strip()]
+    spec = workload.profile("small", start_date=args.date, rows_per_day=args.rows, seed=args.seed)
+
+    engine = harness.configure(args.database_url, args.allow_remote,
+                               ETL_FACT_WORKERS=max(shard_counts))
+    from scripts.integreat import ingest
+    from scripts.integreat import integreat_pipeline as pipeline
+    from scripts.integreat.schema import provision_indexes
+
+    pipeline.define_tables()
+    start_dt, end_dt = spec.window
+    harness.reset_window(engine, start_dt, end_dt, spec.first_log_id, spec.last_log_id)
+
+    print(f"[bench] seeding {spec.total_rows} rows for {args.date}")
+    with tempfile.TemporaryDirectory(prefix="integreat-bench-") as workdir:
+        source = os.path.join(workdir, "workload.ndjson.gz")
+        workload.write_ndjson(spec, source)
+        ingest.ingest([source], rejects_path=os.path.join(workdir, "rejects.ndjson"))
+    provision_indexes(engine)
+    harness.analyze(engine, '"OLTP".api_transactions', '"OLAP".fact_log_transactions')
+
+    results = []
+    for shards in shard_counts:
+        best = None
+        for _ in range(args.repeat):
+            with engine.begin() as conn:
+                conn.exec_driver_sql('TRUNCATE "OLAP".fact_log_transactions')
+            report = pipeline.etl(args.date, fact_shards=shards)
+            if best is None or report["seconds"] < best["seconds"]:
+                best = report
+        results.append((shards, best))
+
+    baseline = results[0][1]["seconds"] or 1e-9
+    print()
+    print(f"{'shards':>6} {'workers':>7} {'rows':>10} {'seconds':>8} {'rows/s':>10} {'speedup':>7}")
+    for shards, report in results:
+        secs = report["seconds"] or 1e-9
+        print(f"{shards:>6} {report['workers']:>7} {report['inserted']:>10} {secs:>8.2f} "
+              f"{report['inserted'] / secs:>10.0f} {baseline / secs:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
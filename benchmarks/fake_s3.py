@@ -0,0 +1,63 @@
+"""
+fake_s3.py
+
+Local stand-in for the boto3 S3 client (and S3Transfer) used by the export code.
+
+Objects are written under a local directory (<root>/<bucket>/<key>) and every
+upload is tallied, so the benchmarks can report bytes uploaded per stage
+without touching AWS. Only the client methods the pipeline calls are
+implemented.
+"""
+
+import os
+import shutil
+import threading
+
+
+class LocalS3:
+    def __init__(self, root):
+        self.root = root
+        self.bytes_uploaded = 0
+        self.objects_uploaded = 0
+        self._lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        path = os.path.join(self.root, bucket, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _record(self, size):
+        with self._lock:
+            self.bytes_uploaded += size
+            self.objects_uploaded += 1
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        shutil.copyfile(Filename, self._path(Bucket, Key))
+        size = os.path.getsize(Filename)
+        if Callback:
+            Callback(size)
+        self._record(size)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(self._path(Bucket, Key), "wb") as f:
+            size = 0
+            for chunk in iter(lambda: Fileobj.read(1024 * 1024), b""):
+                f.write(chunk)
+                size += len(chunk)
+        if Callback:
+            Callback(size)
+        self._record(size)
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        data = Body.encode("utf-8") if isinstance(Body, str) else Body
+        if hasattr(data, "read"):
+            data = data.read()
+        with open(self._path(Bucket, Key), "wb") as f:
+            f.write(data)
+        self._record(len(data))
+        return {}
+
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_uploaded = 0
+            self.objects_uploaded = 0
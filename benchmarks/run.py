@@ -0,0 +1,184 @@
+"""
+run.py
+
+End-to-end benchmark for the nightly pipeline against a local Postgres.
+
+Stages, in order, each measured for wall time, rows/sec, peak RSS and bytes
+uploaded:
+    generate  seeded synthetic workload written as NDJSON.gz (workload.py)
+    ingest    COPY of that file into OLTP.api_transactions (ingest.py)
+    etl       dims + fact load, etl() per day
+    marts     create_data_marts() per day
+    export    export_and_upload() per tenant per day, into a local S3 stand-in
+
+Results are compared against benchmarks/baselines.json for the chosen
+profile; any stage that is slower, or uses more memory or bytes, than its
+baseline by more than --tolerance fails the run with a non-zero exit code.
+A profile without a baseline also fails (exit 2), so a missing or renamed
+baselines.json cannot turn the check into a silent pass.
+
+Usage (from the repo root):
+    python -m benchmarks.run --profile small
+    python -m benchmarks.run --profile small --update-baseline   # on the reference machine
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks import harness, workload
+from benchmarks.fake_s3 import LocalS3
+
+BASELINES_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+# metric -> +1 when higher is worse, -1 when lower is worse
+REGRESSION_DIRECTION = {
+    "wall_seconds": +1,
+    "peak_rss_mb": +1,
+    "bytes_uploaded": +1,
+    "rows_per_sec": -1,
+}
+
+
+def run_stages(spec, fact_shards=None, keep_files=False):
+    """Run every stage for `spec` and return a list of StageResult."""
+    from scripts.integreat import ingest
+    from scripts.integreat import integreat_pipeline as pipeline
+    from integreat_analytics.template import tenant_handler_template as template
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="integreat-bench-")
+    source = os.path.join(workdir, "workload.ndjson.gz")
+
+    with harness.measure("generate") as stage:
+        stage.rows, stage.extra["file_bytes"] = workload.write_ndjson(spec, source)
+    results.append(stage)
+
+    pipeline.define_tables()
+    start_dt, end_dt = spec.window
+    harness.reset_window(pipeline.engine, start_dt, end_dt, spec.first_log_id, spec.last_log_id)
+
+    with harness.measure("ingest") as stage:
+        report = ingest.ingest([source], rejects_path=os.path.join(workdir, "rejects.ndjson"))
+        stage.rows = report["rows_loaded"]
+        stage.extra["rows_rejected"] = report["rows_rejected"]
+    results.append(stage)
+    harness.analyze(pipeline.engine, '"OLTP".api_transactions')
+
+    with harness.measure("etl") as stage:
+        for date_str in spec.dates:
+            stage.rows += pipeline.etl(date_str, fact_shards=fact_shards)["inserted"]
+    results.append(stage)
+
+    with harness.measure("marts") as stage:
+        for date_str in spec.dates:
+            stage.rows += sum(pipeline.create_data_marts(date_str).values())
+    results.append(stage)
+
+    fake_s3 = LocalS3(os.path.join(workdir, "s3"))
+    template.S3 = template.S3_TRANSFER = fake_s3
+    with harness.measure("export") as stage:
+        for date_str in spec.dates:
+            for tenant in workload.TENANTS:
+                stage.rows += template.export_and_upload(date_str, tenant)
+        stage.bytes_uploaded = fake_s3.bytes_uploaded
+        stage.extra["objects_uploaded"] = fake_s3.objects_uploaded
+    results.append(stage)
+
+    if keep_files:
+        print(f"[bench] files kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against `baseline`."""
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.stage)
+        if not expected:
+            continue
+        current = result.as_dict()
+        for metric, direction in REGRESSION_DIRECTION.items():
+            old, new = expected.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                regressions.append(
+                    f"{result.stage}.{metric}: {new} vs baseline {old} ({change:+.0%})"
+                )
+    return regressions
+
+
+def _print_table(results):
+    print()
+    print(f"{'stage':<9} {'rows':>10} {'seconds':>8} {'rows/s':>10} {'peak MB':>8} {'uploaded':>10}")
+    for r in results:
+        rate = f"{r.rows_per_sec:>10.0f}" if r.rows_per_sec else f"{'-':>10}"
+        print(f"{r.stage:<9} {r.rows:>10} {r.wall_seconds:>8.2f} {rate} "
+              f"{r.peak_rss_mb:>8.1f} {r.bytes_uploaded:>10}")
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    harness.add_database_args(parser)
+    parser.add_argument("--profile", default="small", choices=sorted(workload.PROFILES))
+    parser.add_argument("--rows-per-day", type=int, help="override the profile's rows_per_day")
+    parser.add_argument("--days", type=int, help="override the profile's day count")
+    parser.add_argument("--seed", type=int, help="override the profile's seed")
+    parser.add_argument("--fact-shards", type=int, help="fact shards for etl() (default ETL_FACT_SHARDS)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression per metric (default 0.25)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store this run as the profile's baseline instead of comparing")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep-files", action="store_true", help="keep the workload and exported CSVs")
+    args = parser.parse_args(argv)
+
+    spec = workload.profile(args.profile, rows_per_day=args.rows_per_day, days=args.days, seed=args.seed)
+    env = {"ETL_FACT_WORKERS": args.fact_shards} if args.fact_shards else {}
+    harness.configure(args.database_url, args.allow_remote, **env)
+
+    print(f"[bench] profile={args.profile} rows={spec.total_rows} days={spec.days} seed={spec.seed}")
+    results = run_stages(spec, fact_shards=args.fact_shards, keep_files=args.keep_files)
+    _print_table(results)
+
+    current = {r.stage: r.as_dict() for r in results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"profile": args.profile, "spec": spec.__dict__, "stages": current}, f, indent=2)
+
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    if args.update_baseline:
+        baselines[args.profile] = current
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"[bench] baseline for '{args.profile}' written to {BASELINES_PATH}")
+        return 0
+
+    if args.profile not in baselines:
+        print(f"[bench] no baseline for '{args.profile}' in {BASELINES_PATH}; "
+              f"run with --update-baseline on the reference machine to record one")
+        return 2
+
+    regressions = compare(results, baselines[args.profile], args.tolerance)
+    if regressions:
+        print("=" * 72)
+        print(f"PERFORMANCE REGRESSION ({len(regressions)}) vs '{args.profile}' baseline "
+              f"(tolerance {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  - {line}")
+        print("=" * 72)
+        return 1
+    print(f"[bench] within {args.tolerance:.0%} of the '{args.profile}' baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+workload.py
+
+Seeded synthetic generator for OLTP.api_transactions.
+
+Models the traffic the nightly pipeline sees: a diurnal request curve,
+Zipf-skewed tenant share, a bounded set of locations and services, log-normal
+request/response payload sizes and a configurable error rate. The same spec
+and seed always produce the same rows, so benchmark runs are comparable.
+
+Records are plain dicts keyed by the OLTP column names, which is what
+scripts/integreat/ingest.py validates and loads.
+"""
+
+import bisect
+import gzip
+import json
+import math
+import os
+import random
+import string
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+
+TENANTS = ["campus", "teleo", "pillars", "evntgarde"]
+
+# Valid roles per origin (mirrors role_valid in etl()); a small share of
+# traffic carries an unexpected role so the 'Unknown' path is exercised.
+TENANT_ROLES = {
+    "teleo": ["Normal_User", "Guest", "Church_Admin", "Pastor"],
+    "campus": ["Student", "Professor", "Admin"],
+    "evntgarde": ["Customer", "Organizer", "Vendor"],
+    "pillars": ["Employer", "Dean", "Professor", "Student"],
+}
+THIRD_PARTY = ["Maps", "Payments", "Sms", "Email", "Storage", "Identity", "Search", "Weather"]
+REGIONS = ["NCR", "Calabarzon", "Central Luzon", "Central Visayas", "Davao", "Western Visayas"]
+METHODS = ["GET", "GET", "GET", "POST", "POST", "PUT", "DELETE"]
+ERRORS = [(400, "validation failed"), (401, "unauthorized"), (404, "not found"),
+          (500, "internal error"), (502, "bad gateway"), (504, "upstream timeout")]
+
+# Relative request volume per hour of day (UTC+8 office hours peak)
+HOURLY_WEIGHTS = [2, 1, 1, 1, 1, 2, 4, 7, 10, 12, 12, 11, 10, 11, 12, 12, 11, 9, 7, 6, 5, 4, 3, 2]
+
+
+@dataclass(frozen=True)
+class WorkloadSpec:
+    start_date: str = "2024-01-15"
+    days: int = 1
+    rows_per_day: int = 100_000
+    seed: int = 42
+    tenant_skew: float = 1.1           # Zipf exponent over TENANTS; 0 = uniform
+    payload_median_bytes: int = 300    # median request/response body size
+    payload_sigma: float = 1.0         # log-normal spread of body sizes
+    payload_max_bytes: int = 64_000
+    locations: int = 200               # distinct location tuples
+    services: int = 24                 # distinct (destination, api_version) pairs
+    error_rate: float = 0.03
+    first_log_id: int = 1_000_000_000
+
+    @property
+    def total_rows(self):
+        return self.days * self.rows_per_day
+
+    @property
+    def last_log_id(self):
+        return self.first_log_id + self.total_rows - 1
+
+    @property
+    def window(self):
+        start = datetime.strptime(self.start_date, "%Y-%m-%d")
+        return start, start + timedelta(days=self.days)
+
+    @property
+    def dates(self):
+        start, _ = self.window
+        return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(self.days)]
+
+
+PROFILES = {
+    "smoke":  WorkloadSpec(rows_per_day=10_000, locations=50, services=12),
+    "small":  WorkloadSpec(rows_per_day=100_000),
+    "medium": WorkloadSpec(rows_per_day=1_000_000, locations=1_000, services=40),
+    "wide":   WorkloadSpec(rows_per_day=250_000, payload_median_bytes=2_000, payload_sigma=1.4),
+}
+
+
+def profile(name, **overrides):
+    """Look up a named profile, optionally overriding fields."""
+    try:
+        spec = PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown profile '{name}', expected one of {sorted(PROFILES)}")
+    return replace(spec, **{k: v for k, v in overrides.items() if v is not None})
+
+
+def _weighted_cdf(weights):
+    total = float(sum(weights))
+    acc, cdf = 0.0, []
+    for w in weights:
+        acc += w / total
+        cdf.append(acc)
+    cdf[-1] = 1.0
+    return cdf
+
+
+def generate(spec: WorkloadSpec):
+    """Yield spec.total_rows records in created_at order."""
+    rng = random.Random(spec.seed)
+
+    locations = []
+    for i in range(spec.locations):
+        lat = round(rng.uniform(5.0, 19.0), 5)
+        lon = round(rng.uniform(117.0, 126.0), 5)
+        locations.append(("Philippines", REGIONS[i % len(REGIONS)], f"City {i:04d}",
+                          f"{1000 + i % 9000:04d}", lat, lon))
+
+    destinations = [t.title() for t in TENANTS] + THIRD_PARTY
+    services = [(destinations[i % len(destinations)], f"v{1 + i // len(destinations)}")
+                for i in range(spec.services)]
+
+    tenant_cdf = _weighted_cdf([1.0 / (rank + 1) ** spec.tenant_skew for rank in range(len(TENANTS))])
+    hour_cdf = _weighted_cdf(HOURLY_WEIGHTS)
+    # Location popularity is skewed too: a few cities carry most traffic
+    location_cdf = _weighted_cdf([1.0 / (rank + 1) for rank in range(len(locations))])
+
+    # Payload text is sliced out of one random block instead of built per row
+    block = "".join(rng.choices(string.ascii_letters + string.digits + " ", k=spec.payload_max_bytes * 2))
+    mu = math.log(max(1, spec.payload_median_bytes))
+
+    def pick(cdf, items):
+        return items[min(bisect.bisect_left(cdf, rng.random()), len(cdf) - 1)]
+
+    def payload():
+        size = min(spec.payload_max_bytes, int(rng.lognormvariate(mu, spec.payload_sigma)))
+        offset = rng.randrange(0, spec.payload_max_bytes)
+        return block[offset:offset + size]
+
+    log_id = spec.first_log_id
+    start, _ = spec.window
+    for day in range(spec.days):
+        day_start = start + timedelta(days=day)
+        # Draw timestamps for the day up front so rows come out in time order
+        offsets = sorted(
+            pick(hour_cdf, range(24)) * 3600 + rng.random() * 3600
+            for _ in range(spec.rows_per_day)
+        )
+        for offset in offsets:
+            tenant = pick(tenant_cdf, TENANTS)
+            roles = TENANT_ROLES[tenant]
+            role = rng.choice(roles) if rng.random() > 0.01 else "Intruder"
+            country, region, city, zip_code, lat, lon = pick(location_cdf, locations)
+            destination, api_version = rng.choice(services)
+            if rng.random() < spec.error_rate:
+                status, error_message = rng.choice(ERRORS)
+            else:
+                status, error_message = (201 if rng.random() < 0.1 else 200), None
+            yield {
+                "log_id": log_id,
+                "created_at": (day_start + timedelta(seconds=offset)).isoformat(sep=" "),
+                "country": country,
+                "region": region,
+                "city": city,
+                "zip_code": zip_code,
+                "latitude": lat,
+                "longitude": lon,
+                "role": role,
+                "origin": tenant,
+                "destination": destination,
+                "api_version": api_version,
+                "request_method": rng.choice(METHODS),
+                "request_url": f"/api/{api_version}/{destination.lower()}/{log_id % 5000}",
+                "request_headers": '{"content-type": "application/json"}',
+                "request_body": payload(),
+                "response_status_code": status,
+                "response_body": payload(),
+                "execution_time_ms": int(rng.lognormvariate(4.0, 0.8)),
+                "error_message": error_message,
+            }
+            log_id += 1
+
+
+def write_ndjson(spec: WorkloadSpec, path):
+    """Write the workload as gzip-compressed NDJSON; returns (rows, bytes on disk)."""
+    rows = 0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=1) as f:
+        for record in generate(spec):
+            f.write(json.dumps(record, separators=(",", ":")))
+            f.write("\n")
+            rows += 1
+    return rows, os.path.getsize(path)
@@ -5,11 +5,15 @@ This package defines the CDK infrastructure for the Integreat analytics system.
 
 Responsibilities:
 - Provision tenant-specific analytics Lambdas (per handler.py)
-- Schedule those Lambdas using EventBridge (runs nightly at 12MN)
+- Schedule the nightly pipeline using EventBridge + Step Functions (runs nightly at 12MN)
 - Pass runtime configuration via CDK context or environment variables
 - Does not rely on AWS Secrets Manager (secure values are handled outside)
 
 Stacks included:
 - tenant_lambda_stack.py: Deploys per-tenant analytics Lambda
-- eventbridge_stack.py: Schedules the Lambda with a cron rule
+- eventbridge_stack.py: Cron rule starting the nightly state machine (ETL -> marts -> exports)
+
+Runtime helpers bundled into the Lambdas:
+- metrics.py: Per-stage timers and counters emitted as CloudWatch EMF log lines
+- nightly_dag.py: The nightly stage graph, retries and concurrency limit
 """
@@ -1,14 +1,28 @@
 """
 eventbridge_stack.py
 
-This CDK stack creates an EventBridge rule (cron scheduler) that triggers
-a target Lambda function at a defined interval (e.g., daily at 12 midnight).
+This CDK stack schedules the nightly pipeline: an EventBridge rule (cron)
+starts a Step Functions state machine that runs the stages as a DAG
+(see nightly_dag.py) instead of triggering every Lambda at once.
 
 Responsibilities:
 - Defines a rule using EventBridge Schedule (cron)
-- Binds the rule to the specified tenant Lambda
+- Defines the Integreat ETL Lambda
+- Builds the nightly state machine:
+    1. ETL Lambda with {"stage": "etl"} (dims + fact)
+    2. Map over the tenants, MAX_CONCURRENCY at a time:
+       ETL Lambda with {"stage": "mart", "tenant": ...}, then that
+       tenant's export Lambda, both for the date and run ID the ETL used
+    3. Fails the execution if any tenant failed after its retries
+- Retries each stage with the backoff from nightly_dag.STAGES
 
-This scheduler is used to automate analytics extraction and upload for each tenant.
+With `-c batch_export=true` the map only reloads the marts. A single
+batch-analytics-handler invocation then exports every tenant whose mart
+loaded (see tenant_lambda_stack.py), and the execution still fails if any
+mart did not.
+
+Exports now only start once their mart has been reloaded, so they no longer
+ship the previous state of the marts.
 The trigger time is set to match the operational timezone (e.g., GMT+8 for 12MN).
 """
 
@@ -17,19 +31,30 @@ from aws_cdk import (
     aws_events as events,
     aws_events_targets as targets,
     aws_lambda as lambda_,
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as tasks,
 )
 from aws_cdk.aws_lambda_python_alpha import PythonFunction
 from constructs import Construct
 from aws_cdk import Duration
 import os
 
+from integreat_analytics.nightly_dag import MAX_CONCURRENCY, STAGES, TENANTS, TENANT_FAILED
+
+def _with_retry(task, spec):
+    task.add_retry(
+        errors=[sfn.Errors.ALL],
+        interval=Duration.seconds(int(spec.backoff_seconds)),
+        max_attempts=spec.retries,
+        backoff_rate=spec.backoff_rate,
+    )
+    return task
+
 class EventBridgeStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        tenants = ['campus', 'evntgarde', 'pillars', 'teleo']
-
-        # Create a single rule for all analytics exports
+        # Daily trigger for the nightly pipeline
         analytics_rule = events.Rule(
             self, "AnalyticsDailyRule",
             schedule=events.Schedule.cron(
@@ -39,18 +64,10 @@ class EventBridgeStack(Stack):
                 month='*',
                 year='*'
             ),
-            description="Daily trigger for all analytics exports"
+            description="Daily trigger for the nightly analytics pipeline"
         )
 
-        # Add each tenant Lambda as a target
-        for tenant in tenants:
-            fn = lambda_.Function.from_function_name(
-                self, f"{tenant.title()}AnalyticsLambda",
-                function_name=f"{tenant}-analytics-handler"
-            )
-            analytics_rule.add_target(targets.LambdaFunction(fn))
-
-        # Optionally, add the Integreat ETL Lambda as a target too
+        # The Integreat ETL Lambda runs both the etl and the mart stages
         etl_lambda = PythonFunction(
             self, "IntegreatETLLambda",
             entry=".",  # Root directory containing scripts/
@@ -71,4 +88,124 @@ class EventBridgeStack(Stack):
                 ]
             }
         )
-        analytics_rule.add_target(targets.LambdaFunction(etl_lambda))
\ No newline at end of file
+
+        # 1. ETL: the rule input ({"stage": "etl", "tenants": [...]}) is passed
+        # through, so manual executions can add date_str, fact_shards, ...
+        etl_task = _with_retry(tasks.LambdaInvoke(
+            self, "RunETL",
+            lambda_function=etl_lambda,
+            payload=sfn.TaskInput.from_json_path_at("$"),
+            result_selector={
+                "date_str": sfn.JsonPath.string_at("$.Payload.body.date_str"),
+                "run_id": sfn.JsonPath.string_at("$.Payload.body.run_id"),
+            },
+            result_path="$.etl",
+            task_timeout=sfn.Timeout.duration(Duration.seconds(STAGES["etl"].timeout_seconds)),
+        ), STAGES["etl"])
+
+        # 2. Per tenant: reload the mart, then export it
+        mart_task = _with_retry(tasks.LambdaInvoke(
+            self, "LoadMart",
+            lambda_function=etl_lambda,
+            payload=sfn.TaskInput.from_object({
+                "stage": "mart",
+                "tenant": sfn.JsonPath.string_at("$.tenant"),
+                "date_str": sfn.JsonPath.string_at("$.date_str"),
+                "run_id": sfn.JsonPath.string_at("$.run_id"),
+            }),
+            result_path=sfn.JsonPath.DISCARD,
+            task_timeout=sfn.Timeout.duration(Duration.seconds(STAGES["mart"].timeout_seconds)),
+        ), STAGES["mart"])
+
+        # Each tenant yields its name on success, TENANT_FAILED otherwise
+        tenant_ok = sfn.Pass(self, "TenantSucceeded", output_path="$.tenant")
+        tenant_failed = sfn.Pass(self, "TenantFailed", result=sfn.Result.from_string(TENANT_FAILED))
+        mart_task.add_catch(tenant_failed, errors=[sfn.Errors.ALL], result_path=sfn.JsonPath.DISCARD)
+
+        batch_export = str(self.node.try_get_context("batch_export")).lower() == "true"
+        if batch_export:
+            after_mart = tenant_ok
+        else:
+            after_mart = sfn.Choice(self, "ExportForTenant")
+            for tenant in TENANTS:
+                fn = lambda_.Function.from_function_name(
+                    self, f"{tenant.title()}AnalyticsLambda",
+                    function_name=f"{tenant}-analytics-handler"
+                )
+                export_task = _with_retry(tasks.LambdaInvoke(
+                    self, f"Export{tenant.title()}",
+                    lambda_function=fn,
+                    payload=sfn.TaskInput.from_object({
+                        "date_str": sfn.JsonPath.string_at("$.date_str"),
+                        "run_id": sfn.JsonPath.string_at("$.run_id"),
+                    }),
+                    result_path=sfn.JsonPath.DISCARD,
+                    task_timeout=sfn.Timeout.duration(Duration.seconds(STAGES["export"].timeout_seconds)),
+                ), STAGES["export"])
+                export_task.add_catch(tenant_failed, errors=[sfn.Errors.ALL], result_path=sfn.JsonPath.DISCARD)
+                after_mart.when(sfn.Condition.string_equals("$.tenant", tenant), export_task.next(tenant_ok))
+            after_mart.otherwise(tenant_failed)
+
+        per_tenant = sfn.Map(
+            self, "MartsAndExports",
+            items_path="$.tenants",
+            max_concurrency=MAX_CONCURRENCY,
+            item_selector={
+                "tenant": sfn.JsonPath.string_at("$$.Map.Item.Value"),
+                "date_str": sfn.JsonPath.string_at("$.etl.date_str"),
+                "run_id": sfn.JsonPath.string_at("$.etl.run_id"),
+            },
+            result_path="$.tenant_status",
+        )
+        per_tenant.item_processor(mart_task.next(after_mart))
+
+        # 3. One failed tenant does not stop the others, but fails the run
+        check = sfn.Pass(
+            self, "CheckTenants",
+            parameters={"any_failed": sfn.JsonPath.array_contains(
+                sfn.JsonPath.list_at("$.tenant_status"), TENANT_FAILED)},
+            result_path="$.check",
+        )
+        outcome = (
+            sfn.Choice(self, "AllTenantsSucceeded")
+            .when(sfn.Condition.boolean_equals("$.check.any_failed", True),
+                  sfn.Fail(self, "NightlyFailed", error="TenantFailed",
+                           cause="At least one tenant mart or export failed after retries"))
+            .otherwise(sfn.Succeed(self, "NightlySucceeded"))
+        )
+        if batch_export:
+            # Export the tenants whose mart loaded (the handler drops the
+            # TENANT_FAILED entries), then fail the run if any mart did not.
+            # The handler retries failed tenants itself, so there is no state
+            # machine retry that would re-export the tenants already shipped.
+            batch_fn = lambda_.Function.from_function_name(
+                self, "BatchAnalyticsLambda", function_name="batch-analytics-handler"
+            )
+            export_all = tasks.LambdaInvoke(
+                self, "ExportAllTenants",
+                lambda_function=batch_fn,
+                payload=sfn.TaskInput.from_object({
+                    "tenants": sfn.JsonPath.list_at("$.tenant_status"),
+                    "date_str": sfn.JsonPath.string_at("$.etl.date_str"),
+                    "run_id": sfn.JsonPath.string_at("$.etl.run_id"),
+                }),
+                result_path=sfn.JsonPath.DISCARD,
+                task_timeout=sfn.Timeout.duration(Duration.seconds(STAGES["export"].timeout_seconds)),
+            )
+            tail = check.next(export_all).next(outcome)
+        else:
+            tail = check.next(outcome)
+
+        state_machine = sfn.StateMachine(
+            self, "NightlyPipeline",
+            state_machine_name="integreat-nightly-pipeline",
+            definition_body=sfn.DefinitionBody.from_chainable(
+                etl_task.next(per_tenant).next(tail)
+            ),
+            timeout=Duration.hours(3),
+        )
+
+        analytics_rule.add_target(targets.SfnStateMachine(
+            state_machine,
+            input=events.RuleTargetInput.from_object({"stage": "etl", "tenants": list(TENANTS)}),
+        ))
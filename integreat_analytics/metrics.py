@@ -0,0 +1,142 @@
+"""
+metrics.py
+
+Structured per-stage metrics for the ETL pipeline and the tenant exports.
+
+Every stage (dim upsert, fact shard, mart load, export query + CSV stream,
+S3 upload, ...) is timed and emitted as a single JSON log line in CloudWatch
+Embedded Metric Format, so CloudWatch turns the Lambda logs into metrics
+without any API calls. Each line carries a RunId property; nightly runs use
+`nightly-<date>` by default, which ties the ETL run and the four tenant
+exports for the same date together without passing anything between them.
+
+Usage:
+    metrics = Metrics("etl", run_id_for(date_str))
+    with metrics.stage("fact_load") as stage:
+        with stage.begin(engine) as conn:     # records pool wait
+            stage.add("Rows", conn.execute(stmt).rowcount)
+
+Set METRICS_ENABLED=0 to silence the metric lines (e.g. in local runs).
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Optional
+
+NAMESPACE = os.getenv("METRICS_NAMESPACE", "Integreat/Pipeline")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Units for the well-known metrics; anything else defaults to Count
+UNITS = {
+    "Duration": "Milliseconds",
+    "PoolWait": "Milliseconds",
+    "Bytes": "Bytes",
+}
+
+_emit_lock = threading.Lock()
+
+def run_id_for(date_str: Optional[str] = None, run_id: Optional[str] = None) -> str:
+    """The run ID for a pipeline date: an explicit ID wins, else nightly-<date>."""
+    if run_id:
+        return run_id
+    if date_str:
+        return f"nightly-{date_str}"
+    return f"adhoc-{int(time.time())}"
+
+class Stage:
+    """Counters for one stage; emitted as one EMF line when the stage ends."""
+
+    def __init__(self, metrics, name, dimensions):
+        self.metrics = metrics
+        self.name = name
+        self.dimensions = dimensions
+        self.values = {}
+        self.properties = {}
+
+    def add(self, metric: str, value=1):
+        """Add to a counter (Rows, Bytes, Retries, PoolWait, ...)."""
+        self.values[metric] = self.values.get(metric, 0) + (value or 0)
+
+    def set(self, metric: str, value):
+        self.values[metric] = value
+
+    def note(self, **properties):
+        """Attach non-metric context (e.g. the shard window) to the log line."""
+        self.properties.update(properties)
+
+    @contextmanager
+    def begin(self, engine):
+        """engine.begin(), recording how long the pool took to hand out a connection."""
+        started = perf_counter()
+        with engine.begin() as conn:
+            self.add("PoolWait", (perf_counter() - started) * 1000)
+            self.add("Checkouts")
+            yield conn
+
+    @contextmanager
+    def connect(self, engine):
+        """engine.connect(), recording how long the pool took to hand out a connection."""
+        started = perf_counter()
+        with engine.connect() as conn:
+            self.add("PoolWait", (perf_counter() - started) * 1000)
+            self.add("Checkouts")
+            yield conn
+
+class Metrics:
+    """
+    Emits stage metrics for one component (etl, export, ...) of one run.
+    Dimensions are low-cardinality (Component, Stage, Tenant); the run ID
+    and any extra context are written as searchable properties instead.
+    """
+
+    def __init__(self, component: str, run_id: Optional[str] = None, **properties):
+        self.component = component
+        self.run_id = run_id or run_id_for()
+        self.properties = properties
+
+    @contextmanager
+    def stage(self, name: str, tenant: Optional[str] = None):
+        dimensions = {"Component": self.component, "Stage": name}
+        if tenant:
+            dimensions["Tenant"] = tenant
+        stage = Stage(self, name, dimensions)
+        started = perf_counter()
+        failed = 0
+        try:
+            yield stage
+        except BaseException:
+            failed = 1
+            raise
+        finally:
+            stage.set("Duration", round((perf_counter() - started) * 1000, 3))
+            stage.set("Failed", max(failed, stage.values.get("Failed", 0)))
+            self.emit(stage)
+
+    def emit(self, stage: Stage):
+        if not METRICS_ENABLED:
+            return
+        values = {k: (round(v, 3) if isinstance(v, float) else v) for k, v in stage.values.items()}
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(stage.dimensions)],
+                    "Metrics": [{"Name": k, "Unit": UNITS.get(k, "Count")} for k in values],
+                }],
+            },
+            **self.properties,
+            **stage.properties,
+            **stage.dimensions,
+            "RunId": self.run_id,
+            **values,
+        }
+        line = json.dumps(record, default=str)
+        with _emit_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
@@ -0,0 +1,94 @@
+"""
+nightly_dag.py
+
+The nightly pipeline as a dependency graph, shared by the Step Functions
+state machine (eventbridge_stack.py) and the local in-process runner
+(scripts/integreat/orchestrator.py).
+
+    etl ──┬── mart:campus ──── export:campus
+          ├── mart:evntgarde ─ export:evntgarde
+          ├── mart:pillars ─── export:pillars
+          └── mart:teleo ───── export:teleo
+
+The marts only start once the ETL has committed, and each tenant export
+waits for its own mart, so an export never ships the previous day's state.
+Mart + export chains run in parallel, at most MAX_CONCURRENCY tenants at a
+time, instead of every Lambda hitting the database at the same moment.
+
+This module is plain data (no AWS or database imports) so both the CDK app
+and the pipeline can use it.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+TENANTS = ("campus", "evntgarde", "pillars", "teleo")
+
+# Tenant mart + export chains running at once
+MAX_CONCURRENCY = 2
+
+# The state machine's per-tenant result when a chain fails after its retries;
+# a tenant that succeeds yields its own name
+TENANT_FAILED = "failed"
+
+@dataclass(frozen=True)
+class StageSpec:
+    """One kind of stage: how often to retry it and how long to wait between tries."""
+    kind: str
+    retries: int = 2
+    backoff_seconds: float = 30.0
+    backoff_rate: float = 2.0
+    timeout_seconds: int = 900
+
+    def delay(self, attempt: int) -> float:
+        """Wait before retry number `attempt` (1-based)."""
+        return self.backoff_seconds * self.backoff_rate ** (attempt - 1)
+
+STAGES = {
+    "etl":    StageSpec("etl", retries=2, backoff_seconds=60.0),
+    "mart":   StageSpec("mart", retries=2, backoff_seconds=30.0),
+    "export": StageSpec("export", retries=3, backoff_seconds=15.0),
+}
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    spec: StageSpec
+    tenant: Optional[str] = None
+    depends_on: Tuple[str, ...] = ()
+
+    @property
+    def kind(self) -> str:
+        return self.spec.kind
+
+def build_dag(tenants=TENANTS, stages=STAGES):
+    """Return the tasks in dependency order."""
+    tasks = [Task("etl", stages["etl"])]
+    for tenant in tenants:
+        tasks.append(Task(f"mart:{tenant}", stages["mart"], tenant, ("etl",)))
+        tasks.append(Task(f"export:{tenant}", stages["export"], tenant, (f"mart:{tenant}",)))
+    return tasks
+
+def validate(tasks):
+    """
+    Raise ValueError on duplicate names, unknown dependencies or cycles.
+    Returns the tasks in dependency order: each task comes after everything
+    it depends on, and otherwise keeps its position in `tasks`.
+    """
+    names = [t.name for t in tasks]
+    if len(names) != len(set(names)):
+        raise ValueError("Duplicate task names in DAG")
+    known = set(names)
+    for t in tasks:
+        missing = set(t.depends_on) - known
+        if missing:
+            raise ValueError(f"Task {t.name} depends on unknown task(s) {sorted(missing)}")
+    ordered, done, remaining = [], set(), list(tasks)
+    while remaining:
+        ready = next((t for t in remaining if set(t.depends_on) <= done), None)
+        if ready is None:
+            raise ValueError(f"Cycle among tasks {sorted(t.name for t in remaining)}")
+        ordered.append(ready)
+        done.add(ready.name)
+        remaining.remove(ready)
+    return ordered
@@ -8,22 +8,50 @@ their directory and customize as needed.
 
 import os
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time, timezone, timedelta
+from time import sleep
 from typing import Optional
 
 import boto3
+from boto3.s3.transfer import S3Transfer, TransferConfig
 from sqlalchemy import create_engine, select, MetaData, Table
 from dotenv import load_dotenv
 
+from integreat_analytics.metrics import Metrics, run_id_for
+from integreat_analytics.nightly_dag import STAGES
+
 # Load environment variables
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("Please set DATABASE_URL in your .env")
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+# Batch mode (export_tenants): tenants exported at once from one process
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "4"))
+# Rows fetched per round trip while streaming a mart to CSV
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "5000"))
 
 # Initialize clients
-engine = create_engine(DATABASE_URL, connect_args={"sslmode": "require"}, echo=False)
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"sslmode": DATABASE_SSLMODE},
+    pool_size=max(5, EXPORT_WORKERS),
+    echo=False,
+)
 S3 = boto3.client("s3")
+# Large CSVs go up as parallel multipart chunks
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=int(os.getenv("EXPORT_UPLOAD_CONCURRENCY", "8")),
+    use_threads=True,
+)
+# One transfer manager (and its thread pool) for every upload in the process,
+# shared by the tenants of a batch export instead of one per upload_file call
+S3_TRANSFER = S3Transfer(client=S3, config=TRANSFER_CONFIG)
 
 # Define bucket names for each tenant
 BUCKET_NAMES = {
@@ -33,12 +61,20 @@ BUCKET_NAMES = {
     "teleo": "teleo-church-application-tenant-bucket",
 }
 
+_MART_TABLES = {}
+_MART_TABLES_LOCK = threading.Lock()
+
 def get_tenant_mart(tenant: str) -> Table:
-    """Get the tenant's data mart table"""
-    meta = MetaData(schema="OLAP")
-    return Table(f"mart_{tenant.lower()}", meta, autoload_with=engine)
+    """Get the tenant's data mart table (reflected once per process)"""
+    key = tenant.lower()
+    with _MART_TABLES_LOCK:
+        if key not in _MART_TABLES:
+            meta = MetaData(schema="OLAP")
+            _MART_TABLES[key] = Table(f"mart_{key}", meta, autoload_with=engine)
+        return _MART_TABLES[key]
 
-def export_and_upload(date_str: Optional[str] = None, tenant: str = None, last_export_time: Optional[str] = None) -> None:
+def export_and_upload(date_str: Optional[str] = None, tenant: str = None, last_export_time: Optional[str] = None,
+                      run_id: Optional[str] = None) -> int:
     """
     Export tenant's data mart to CSV and upload to their S3 bucket.
     
@@ -47,6 +83,11 @@ def export_and_upload(date_str: Optional[str] = None, tenant: str = None, last_e
                  defaults to yesterday's date.
         tenant: The tenant name (e.g., 'teleo', 'pillars', etc.)
         last_export_time: Optional last export time in YYYY-MM-DDTHH:MM:SS format
+        run_id: Optional run ID for the metrics; defaults to nightly-<date_str>
+                so the export lines up with the ETL run for the same date
+
+    Returns:
+        The number of rows exported (0 when there was nothing to export).
     """
     if not tenant:
         raise ValueError("tenant parameter is required")
@@ -61,9 +102,11 @@ def export_and_upload(date_str: Optional[str] = None, tenant: str = None, last_e
     end_dt = start_dt + timedelta(days=1)
     
     print(f"[{tenant}] Exporting data for {date_str}")
+    metrics = Metrics("export", run_id_for(date_str, run_id), Date=date_str)
     
     # Get tenant's mart table
-    mart_table = get_tenant_mart(tenant)
+    with metrics.stage("reflect", tenant=tenant.lower()):
+        mart_table = get_tenant_mart(tenant)
     
     # If last_export_time is provided, filter by it
     if last_export_time:
@@ -80,36 +123,96 @@ def export_and_upload(date_str: Optional[str] = None, tenant: str = None, last_e
     csv_filename = f"{tenant.lower()}_{date_str}.csv"
     csv_path = os.path.join('/tmp', csv_filename)
     
-    with engine.connect() as conn:
-        result = conn.execute(query)
-        rows = result.fetchall()
-        
+    # Stream the rows straight into the CSV (server-side cursor), so memory
+    # stays flat no matter how large the mart window is. The CSV is removed
+    # however the export ends, so a failed query cannot leave a partial file
+    # filling /tmp (shared by every tenant in a batch export).
+    try:
+        with metrics.stage("query", tenant=tenant.lower()) as stage:
+            rows = 0
+            with stage.connect(engine) as conn:
+                result = conn.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE).execute(query)
+                with open(csv_path, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    # Write header
+                    writer.writerow(result.keys())
+                    # Write data
+                    for partition in result.partitions():
+                        writer.writerows(partition)
+                        rows += len(partition)
+            stage.add("Rows", rows)
+            stage.add("Bytes", os.path.getsize(csv_path))
+
         if not rows:
             print(f"[{tenant}] No data to export for {date_str}")
-            return
-            
-        # Write to CSV
-        with open(csv_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            # Write header
-            writer.writerow(result.keys())
-            # Write data
-            writer.writerows(rows)
-    
-    # Upload to S3
-    bucket_name = BUCKET_NAMES[tenant.lower()]
-    s3_key = f"analytics/{csv_filename}"
-    
-    try:
-        S3.upload_file(csv_path, bucket_name, s3_key)
-        print(f"[{tenant}] Successfully uploaded {csv_filename} to s3://{bucket_name}/{s3_key}")
-    except Exception as e:
-        print(f"[{tenant}] Failed to upload {csv_filename} to S3: {str(e)}")
+            return 0
+
+        # Upload to S3
+        bucket_name = BUCKET_NAMES[tenant.lower()]
+        s3_key = f"analytics/{csv_filename}"
+
+        with metrics.stage("upload", tenant=tenant.lower()) as stage:
+            try:
+                S3_TRANSFER.upload_file(csv_path, bucket_name, s3_key)
+                stage.add("Bytes", os.path.getsize(csv_path))
+                print(f"[{tenant}] Successfully uploaded {csv_filename} to s3://{bucket_name}/{s3_key}")
+            except Exception as e:
+                # Re-raised so the nightly DAG retries the export instead of
+                # recording a successful run that shipped nothing
+                print(f"[{tenant}] Failed to upload {csv_filename} to S3: {str(e)}")
+                raise
     finally:
         # Clean up local CSV file
         if os.path.exists(csv_path):
             os.remove(csv_path)
 
+    return rows
+
+def export_tenants(date_str: Optional[str] = None, tenants: Optional[list] = None,
+                   run_id: Optional[str] = None, max_workers: int = EXPORT_WORKERS,
+                   retries: int = 0, delay=STAGES["export"].delay, sleep=sleep) -> dict:
+    """
+    Export several tenants (default: all; an empty list exports none) from
+    one process, sharing the connection pool, the mart reflection cache and
+    the S3 client. Each tenant is still written only to its own bucket, and
+    a failing tenant does not stop the others.
+
+    Failed tenants are retried up to `retries` times, waiting delay(attempt)
+    seconds first; tenants that already succeeded are not exported again.
+
+    Returns:
+        {tenant: {"status": "ok", "rows": n}} or
+        {tenant: {"status": "failed", "error": "..."}} per tenant.
+    """
+    tenants = list(dict.fromkeys(t.lower() for t in (BUCKET_NAMES if tenants is None else tenants)))
+    unknown = sorted(set(tenants) - set(BUCKET_NAMES))
+    if unknown:
+        raise ValueError(f"Unknown tenant(s) {unknown}, expected some of {sorted(BUCKET_NAMES)}")
+
+    # Resolve the date once so every tenant exports the same day
+    if not date_str:
+        date_str = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    def _export(tenant):
+        try:
+            return {"status": "ok", "rows": export_and_upload(date_str, tenant, run_id=run_id)}
+        except Exception as e:
+            print(f"[{tenant}] Export failed: {e}")
+            return {"status": "failed", "error": str(e)}
+
+    results, todo = {}, tenants
+    for attempt in range(retries + 1):
+        if attempt:
+            wait = delay(attempt)
+            print(f"[batch] retrying {todo} in {wait:g}s (attempt {attempt + 1})")
+            sleep(wait)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as ex:
+            results.update(zip(todo, ex.map(_export, todo)))
+        todo = [t for t in todo if results[t]["status"] != "ok"]
+        if not todo:
+            break
+    return {t: results[t] for t in tenants}
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function.
@@ -118,6 +221,7 @@ def lambda_handler(event, context):
     - date_str: Optional date string in YYYY-MM-DD format
     - tenant: The tenant name (required)
     - last_export_time: Optional last export time in YYYY-MM-DDTHH:MM:SS format
+    - run_id: Optional run ID tying this export to its ETL run
     """
     date_str = event.get('date_str')
     tenant = event.get('tenant')
@@ -126,7 +230,7 @@ def lambda_handler(event, context):
     if not tenant:
         raise ValueError("tenant parameter is required in the event")
     
-    export_and_upload(date_str, tenant, last_export_time)
+    export_and_upload(date_str, tenant, last_export_time, event.get('run_id'))
     
     return {
         'statusCode': 200,
@@ -14,6 +14,16 @@ Responsibilities:
 Each tenant gets its own Lambda to run analytics exports independently.
 This keeps data pipelines isolated and allows for custom logic per tenant.
 
+The stack also deploys analytics-query-handler (scripts/integreat/query_api.py),
+the cached read-only query API over the marts for dashboards. It is exposed
+through API Gateway + Cognito in the separate Node.js stack, and the
+authorizer's `custom:tenant` claim scopes each request to one tenant.
+
+Optional batch mode (`cdk deploy -c batch_export=true`) also deploys
+batch-analytics-handler (scripts/batch_export/handler.py). It exports all
+tenants from one Lambda with a shared connection pool and S3 client, and
+the nightly state machine then calls it instead of the per-tenant Lambdas.
+
 Note:
 - AWS Lambda does not automatically scale CPU or RAM per invocation
 - CPU is scaled proportionally to memory (2GB ≈ 1 vCPU)
@@ -27,6 +37,7 @@ from aws_cdk import (
     aws_lambda as lambda_,
     aws_iam as iam,
     Duration,
+    Size,
 )
 from aws_cdk.aws_lambda_python_alpha import PythonFunction
 from constructs import Construct
@@ -55,6 +66,13 @@ class TenantLambdaStack(Stack):
             }
         }
 
+        bucket_names = {
+            "campus": "campus-student-lifecycle-tenant-bucket",
+            "evntgarde": "evntgarde-event-management-tenant-bucket",
+            "pillars": "pillars-edu-quality-assessor-tenant-bucket",
+            "teleo": "teleo-church-application-tenant-bucket",
+        }
+
         # Create Lambda functions for each tenant
         for tenant, config in tenants.items():
             # Create Lambda function
@@ -79,12 +97,6 @@ class TenantLambdaStack(Stack):
             )
 
             # Grant S3 access to the Lambda
-            bucket_names = {
-                "campus": "campus-student-lifecycle-tenant-bucket",
-                "evntgarde": "evntgarde-event-management-tenant-bucket",
-                "pillars": "pillars-edu-quality-assessor-tenant-bucket",
-                "teleo": "teleo-church-application-tenant-bucket",
-            }
             bucket_name = bucket_names[tenant]
             fn.add_to_role_policy(
                 iam.PolicyStatement(
@@ -99,3 +111,65 @@ class TenantLambdaStack(Stack):
                     ]
                 )
             )
+
+        # Optional batch export Lambda: all tenants from one worker
+        if str(self.node.try_get_context("batch_export")).lower() == "true":
+            batch_fn = PythonFunction(
+                self, "BatchAnalyticsLambda",
+                entry=".",
+                index="scripts/batch_export/handler.py",
+                runtime=lambda_.Runtime.PYTHON_3_9,
+                memory_size=2048,  # 2GB
+                # The tenants' CSVs are written to /tmp at the same time; each
+                # tenant Lambda had its own 512 MB, so give every tenant 1 GB here
+                ephemeral_storage_size=Size.mebibytes(1024 * len(tenants)),
+                timeout=Duration.minutes(15),
+                description='Batch analytics export Lambda (all tenants)',
+                function_name="batch-analytics-handler",
+                environment={
+                    'DATABASE_URL': os.getenv('DATABASE_URL', ''),
+                    'EXPORT_WORKERS': str(len(tenants)),
+                },
+                bundling={
+                    'command': [
+                        'bash', '-c',
+                        'pip install -r requirements-lambda.txt -t /asset-output && cp -au /asset-input/scripts /asset-input/integreat_analytics /asset-input/requirements-lambda.txt /asset-output/ && cp /asset-input/.env /asset-output/'
+                    ]
+                }
+            )
+            batch_fn.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=[
+                        's3:PutObject',
+                        's3:GetObject',
+                        's3:ListBucket'
+                    ],
+                    resources=[
+                        arn
+                        for bucket_name in bucket_names.values()
+                        for arn in (f"arn:aws:s3:::{bucket_name}", f"arn:aws:s3:::{bucket_name}/*")
+                    ]
+                )
+            )
+
+        # Cached read API over the marts: short queries, so a small, short-timeout Lambda
+        PythonFunction(
+            self, "AnalyticsQueryLambda",
+            entry=".",
+            index="scripts/integreat/query_api.py",
+            handler="Query_Handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            memory_size=512,
+            timeout=Duration.seconds(30),
+            description='Cached read-only query API over the tenant marts',
+            function_name="analytics-query-handler",
+            environment={
+                'DATABASE_URL': os.getenv('DATABASE_URL', ''),
+            },
+            bundling={
+                'command': [
+                    'bash', '-c',
+                    'pip install -r requirements-lambda.txt -t /asset-output && cp -au /asset-input/scripts /asset-input/integreat_analytics /asset-input/requirements-lambda.txt /asset-output/ && cp /asset-input/.env /asset-output/'
+                ]
+            }
+        )
@@ -0,0 +1,40 @@
+"""
+Batch export – handler.py
+
+Optional single Lambda that exports every tenant (or the subset given in
+the event) in one invocation. It replaces the four per-tenant Lambdas'
+cold starts, engines, mart reflection and S3 clients with one shared set.
+Each tenant's CSV still goes only to that tenant's bucket.
+"""
+
+from integreat_analytics.nightly_dag import STAGES, TENANT_FAILED
+from integreat_analytics.template.tenant_handler_template import export_tenants
+
+def handler(event, context):
+    """
+    AWS Lambda handler for the batch analytics export.
+    The event can contain:
+    - date_str: Optional date string in YYYY-MM-DD format
+    - tenants: Optional list of tenants to export (default: all). The nightly
+      state machine passes its per-tenant results, where a tenant whose mart
+      failed appears as TENANT_FAILED; those entries are dropped.
+    - run_id: Optional run ID tying the exports to their ETL run
+
+    Failed tenants are retried here with the export backoff, so a tenant
+    that already shipped is not exported twice. Raises if any tenant still
+    failed; the message lists the result of every tenant.
+    """
+    event = event or {}
+    tenants = event.get('tenants')
+    if tenants is not None:
+        tenants = [t for t in tenants if t != TENANT_FAILED]
+    spec = STAGES['export']
+    results = export_tenants(event.get('date_str'), tenants, event.get('run_id'),
+                             retries=spec.retries, delay=spec.delay)
+    failed = sorted(t for t, r in results.items() if r['status'] != 'ok')
+    if failed:
+        raise RuntimeError(f"Export failed for {failed}: {results}")
+    return {
+        'statusCode': 200,
+        'body': results
+    }
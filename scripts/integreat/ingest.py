@@ -0,0 +1,488 @@
+"""
+ingest.py
+
+Bulk loader for raw API logs into OLTP.api_transactions.
+
+Streams NDJSON or CSV log files (optionally gzip-compressed, from S3 or local
+disk) into the OLTP table with `COPY ... FROM STDIN`, one bounded batch per
+transaction, so memory stays constant however large the input is. Every record
+is validated first; bad rows are written to a rejects file (NDJSON, one object
+per rejected row with the source, line number and reason) instead of failing
+the load.
+
+Throughput: parsing and encoding are pure Python and run on one core per
+source, at roughly 60-110k rows/s depending on the machine and the payload
+size, and each COPY stream uses one connection. One file therefore cannot
+reach hundreds of thousands of rows/s on its own. To go faster, split the
+input into several files and load them with `--workers N` (INGEST_WORKERS):
+each worker process loads whole sources on its own connection. In AWS the
+same scaling comes from one Ingest_Handler invocation per S3 object. The
+handler itself loads serially, because Lambda has no /dev/shm for
+multiprocessing.
+
+Usage (from the repo root):
+    python -m scripts.integreat.ingest s3://archive-bucket/logs/2024-03/ logs/replay.ndjson.gz
+    python -m scripts.integreat.ingest dump.csv --skip-duplicates --rejects bad_rows.ndjson
+    python -m scripts.integreat.ingest s3://archive-bucket/logs/2024-03/ --workers 4
+
+The Lambda entry point is Ingest_Handler, which accepts either an explicit
+`sources` list or an S3 object-created notification.
+"""
+
+import sys
+import traceback
+import argparse
+import csv
+import gzip
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+from urllib.parse import unquote_plus
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+import boto3
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise RuntimeError("Please set DATABASE_URL in your .env")
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+engine = create_engine(DATABASE_URL, connect_args={"sslmode": DATABASE_SSLMODE}, echo=False)
+S3 = boto3.client("s3")
+
+DEFAULT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "50000"))
+# Processes loading sources in parallel from the CLI (see the module docstring)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+NULL = r"\N"
+
+# Each converter validates one value and returns it already encoded as a
+# COPY CSV field, so every row is walked exactly once on the hot path.
+
+# The integer columns are int4; a wider value would fail the whole COPY batch
+INT4_MIN, INT4_MAX = -2**31, 2**31 - 1
+
+def _int_field(value):
+    if type(value) is int:
+        number = value
+    elif isinstance(value, bool):
+        raise ValueError("boolean is not an integer")
+    elif type(value) is float:
+        # int() would silently truncate 12.5 to 12, colliding with a real log_id
+        if not value.is_integer():
+            raise ValueError(f"{value!r} is not an integer")
+        number = int(value)
+    else:
+        try:
+            number = int(value)
+        except ValueError:
+            as_float = float(value)
+            if not as_float.is_integer():
+                raise ValueError(f"{value!r} is not an integer") from None
+            number = int(as_float)
+    if not INT4_MIN <= number <= INT4_MAX:
+        raise ValueError(f"{value!r} is out of range for an integer column")
+    return str(number)
+
+def _float_field(value):
+    if isinstance(value, bool):
+        raise ValueError("boolean is not a number")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value!r} is not a finite number")
+    return repr(number)
+
+def _timestamp_field(value):
+    """Accept ISO-8601 strings or epoch seconds; emit a naive UTC timestamp."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None).isoformat(sep=" ")
+    text = str(value).strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    # Always re-emit: fromisoformat accepts forms Postgres does not (2024-W10-1)
+    return parsed.isoformat(sep=" ")
+
+def _text_field(max_length=None):
+    def convert(value):
+        text = value if type(value) is str else json.dumps(value, separators=(",", ":"))
+        if "\x00" in text:
+            raise ValueError("contains a NUL character")
+        if max_length is not None and len(text) > max_length:
+            raise ValueError(f"longer than {max_length} characters")
+        # Strings are always quoted so only an unquoted \N reads back as NULL
+        if '"' in text:
+            text = text.replace('"', '""')
+        return '"' + text + '"'
+    return convert
+
+# Column order of the COPY: (name, converter, required).
+# The location and service columns are required because etl() joins the
+# dims on them with plain equality; a NULL there would never reach the fact.
+COLUMNS = (
+    ("log_id",               _int_field,        True),
+    ("created_at",           _timestamp_field,  True),
+    ("country",              _text_field(100),  True),
+    ("region",               _text_field(100),  True),
+    ("city",                 _text_field(100),  True),
+    ("zip_code",             _text_field(20),   True),
+    ("latitude",             _float_field,      True),
+    ("longitude",            _float_field,      True),
+    ("role",                 _text_field(100),  False),
+    ("origin",               _text_field(100),  False),
+    ("destination",          _text_field(100),  True),
+    ("api_version",          _text_field(50),   True),
+    ("request_method",       _text_field(20),   False),
+    ("request_url",          _text_field(),     False),
+    ("request_headers",      _text_field(),     False),
+    ("request_body",         _text_field(),     False),
+    ("response_status_code", _int_field,        False),
+    ("response_body",        _text_field(),     False),
+    ("execution_time_ms",    _int_field,        False),
+    ("error_message",        _text_field(),     False),
+)
+
+def encode_record(record, columns=COLUMNS):
+    """
+    Validate one parsed record (dict) and encode it as a COPY CSV line.
+    Raises ValueError naming the offending column when the record is invalid.
+    """
+    if type(record) is not dict:
+        raise ValueError("record is not an object")
+    fields = []
+    get = record.get
+    for name, convert, required in columns:
+        value = get(name)
+        if value is None or value == "":
+            if required:
+                raise ValueError(f"{name}: missing required value")
+            fields.append(NULL)
+            continue
+        try:
+            fields.append(convert(value))
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValueError(f"{name}: {e}") from None
+    fields[-1] += "\n"
+    return ",".join(fields)
+
+# --- Sources --------------------------------------------------------------
+
+def _split_s3_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+def expand_sources(sources):
+    """Expand S3 prefixes (URIs ending in '/') into the objects below them."""
+    for uri in sources:
+        if uri.startswith("s3://") and uri.endswith("/"):
+            bucket, prefix = _split_s3_uri(uri)
+            paginator = S3.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    if not obj["Key"].endswith("/"):
+                        yield f"s3://{bucket}/{obj['Key']}"
+        else:
+            yield uri
+
+def _detect_format(uri):
+    name = uri[:-3] if uri.endswith(".gz") else uri
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json", ".log")):
+        return "ndjson"
+    raise ValueError(f"Cannot infer format of '{uri}', pass --format")
+
+def _open_text(uri):
+    """Open a local path or s3:// URI as a streaming text file."""
+    if uri.startswith("s3://"):
+        bucket, key = _split_s3_uri(uri)
+        raw = S3.get_object(Bucket=bucket, Key=key)["Body"]
+        if uri.endswith(".gz"):
+            raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    else:
+        raw = gzip.open(uri, "rb") if uri.endswith(".gz") else open(uri, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+def _read_records(stream, fmt):
+    """Yield (line_number, record_or_exception, raw_text) for every input row."""
+    if fmt == "ndjson":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line), line
+            except ValueError as e:
+                yield line_no, ValueError(f"invalid JSON: {e}"), line
+    elif fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, ValueError("more fields than the header"), row
+            else:
+                yield reader.line_num, row, row
+    else:
+        raise ValueError(f"Unsupported format: '{fmt}'")
+
+# --- Loading --------------------------------------------------------------
+
+class _CopyWriter:
+    """Accumulates encoded rows and COPYs them in bounded, committed batches."""
+
+    def __init__(self, conn, columns, batch_size, skip_duplicates):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.skip_duplicates = skip_duplicates
+        self.buffer = io.StringIO()
+        self.pending = 0
+        self.loaded = 0
+        self.duplicates = 0
+        self.batches = 0
+
+        column_list = ", ".join(columns)
+        target = "ingest_stage" if skip_duplicates else '"OLTP".api_transactions'
+        self.copy_sql = f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        self.merge_sql = (
+            f'INSERT INTO "OLTP".api_transactions ({column_list}) '
+            f"SELECT {column_list} FROM ingest_stage "
+            f"ON CONFLICT (log_id) DO NOTHING"
+        )
+        if skip_duplicates:
+            with conn.cursor() as cur:
+                cur.execute(
+                    'CREATE TEMP TABLE IF NOT EXISTS ingest_stage '
+                    '(LIKE "OLTP".api_transactions INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+                )
+            conn.commit()
+
+    def write(self, line):
+        self.buffer.write(line)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.buffer.seek(0)
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(self.copy_sql, self.buffer)
+                if self.skip_duplicates:
+                    cur.execute(self.merge_sql)
+                    inserted = cur.rowcount
+                else:
+                    inserted = self.pending
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.loaded += inserted
+        self.duplicates += self.pending - inserted
+        self.batches += 1
+        self.pending = 0
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+class _Rejects:
+    """Rejected rows as NDJSON, one object per row; the file is created on the first reject."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, uri, line_no, error, raw):
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(json.dumps({
+            "source": uri,
+            "line": line_no,
+            "error": error,
+            "record": raw.rstrip("\r\n") if isinstance(raw, str) else raw,
+        }) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+def _load_sources(uris, fmt, assign_log_ids, batch_size, skip_duplicates, rejects_path):
+    """Stream `uris` in order through one connection; returns their counters."""
+    # Picked here rather than passed in: the _text_field converters cannot be pickled
+    columns = COLUMNS[1:] if assign_log_ids else COLUMNS
+    column_names = [name for name, _, _ in columns]
+    rows_read = 0
+    rejects = _Rejects(rejects_path)
+    raw_conn = engine.raw_connection()
+    try:
+        writer = _CopyWriter(raw_conn, column_names, batch_size, skip_duplicates)
+        for uri in uris:
+            source_fmt = fmt or _detect_format(uri)
+            print(f"[ingest] loading {uri} ({source_fmt})")
+            with _open_text(uri) as stream:
+                for line_no, record, raw in _read_records(stream, source_fmt):
+                    rows_read += 1
+                    try:
+                        if isinstance(record, Exception):
+                            raise record
+                        writer.write(encode_record(record, columns))
+                    except ValueError as e:
+                        rejects.write(uri, line_no, str(e), raw)
+        writer.flush()
+    finally:
+        raw_conn.close()
+        rejects.close()
+    return {"sources": len(uris), "rows_read": rows_read, "rows_rejected": rejects.count,
+            "rows_loaded": writer.loaded, "duplicates_skipped": writer.duplicates,
+            "batches": writer.batches}
+
+def _init_worker():
+    """Drop the parent's pooled connections and S3 client in a forked worker."""
+    global S3
+    engine.dispose(close=False)
+    S3 = boto3.client("s3")
+
+def _merge_rejects(part_paths, rejects_path):
+    """Concatenate the workers' rejects files into `rejects_path`; True if any."""
+    parts = [path for path in part_paths if os.path.exists(path)]
+    if not parts:
+        return False
+    with open(rejects_path, "w", encoding="utf-8") as out:
+        for path in parts:
+            with open(path, encoding="utf-8") as part:
+                out.writelines(part)
+            os.remove(path)
+    return True
+
+def ingest(sources, fmt=None, batch_size=DEFAULT_BATCH_SIZE, rejects_path=None,
+           skip_duplicates=False, assign_log_ids=False, workers=1):
+    """
+    Stream every source into OLTP.api_transactions and return a load report.
+
+    Args:
+        sources: Local paths or s3:// URIs; URIs ending in '/' are prefixes.
+        fmt: 'ndjson' or 'csv'; inferred from each file name when omitted.
+        batch_size: Rows per COPY batch (each batch commits on its own).
+        rejects_path: Where to write rejected rows; defaults to
+                      ingest_rejects.ndjson in the working directory.
+        skip_duplicates: COPY through a temp table and skip log_ids that
+                         already exist, instead of failing the batch.
+        assign_log_ids: Ignore input log_ids and let the table assign them.
+        workers: Processes loading sources in parallel, each on its own
+                 connection. A single source always loads on one core.
+    """
+    skip_duplicates = skip_duplicates and not assign_log_ids
+    rejects_path = rejects_path or "ingest_rejects.ndjson"
+    started = perf_counter()
+
+    uris = list(expand_sources(sources))
+    workers = max(1, min(int(workers), len(uris)))
+    if workers == 1:
+        parts = [_load_sources(uris, fmt, assign_log_ids, batch_size, skip_duplicates, rejects_path)]
+        wrote_rejects = parts[0]["rows_rejected"] > 0
+    else:
+        part_paths = [f"{rejects_path}.part{i}" for i in range(len(uris))]
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+                futures = [ex.submit(_load_sources, [uri], fmt, assign_log_ids, batch_size,
+                                     skip_duplicates, path)
+                           for uri, path in zip(uris, part_paths)]
+                parts = [f.result() for f in futures]
+        finally:
+            wrote_rejects = _merge_rejects(part_paths, rejects_path)
+
+    report = {key: sum(part[key] for part in parts)
+              for key in ("sources", "rows_read", "rows_loaded", "rows_rejected",
+                          "duplicates_skipped", "batches")}
+    seconds = perf_counter() - started
+    report.update({
+        "rejects_path": rejects_path if wrote_rejects else None,
+        "workers": workers,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(report["rows_loaded"] / seconds) if seconds else None,
+    })
+    print(f"[ingest] loaded {report['rows_loaded']} rows in {report['batches']} batch(es) "
+          f"on {workers} worker(s), rejected {report['rows_rejected']}, "
+          f"skipped {report['duplicates_skipped']} duplicate(s) in {report['seconds']}s")
+    return report
+
+def Ingest_Handler(event, context):
+    """
+    AWS Lambda handler for bulk log ingest.
+
+    The event can contain:
+    - sources: list of s3:// URIs (a trailing '/' loads a whole prefix)
+    - Records: an S3 object-created notification (used when `sources` is absent)
+    - format, batch_size, skip_duplicates, assign_log_ids: see ingest()
+    - rejects_uri: s3:// URI for the rejects file; defaults to
+      s3://<first source bucket>/rejects/<timestamp>.ndjson
+    """
+    event = event or {}
+    sources = event.get('sources')
+    if not sources:
+        sources = [
+            f"s3://{r['s3']['bucket']['name']}/{unquote_plus(r['s3']['object']['key'])}"
+            for r in event.get('Records', [])
+        ]
+    if not sources:
+        raise ValueError("sources or S3 Records are required in the event")
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    rejects_path = os.path.join('/tmp', f"ingest_rejects_{stamp}.ndjson")
+    report = ingest(
+        sources,
+        fmt=event.get('format'),
+        batch_size=int(event.get('batch_size', DEFAULT_BATCH_SIZE)),
+        rejects_path=rejects_path,
+        skip_duplicates=bool(event.get('skip_duplicates', False)),
+        assign_log_ids=bool(event.get('assign_log_ids', False)),
+    )
+
+    rejects_uri = event.get('rejects_uri')
+    if not rejects_uri and sources[0].startswith("s3://"):
+        bucket, _ = _split_s3_uri(sources[0])
+        rejects_uri = f"s3://{bucket}/rejects/{stamp}.ndjson"
+
+    if report["rejects_path"] and rejects_uri:
+        bucket, key = _split_s3_uri(rejects_uri)
+        try:
+            S3.upload_file(rejects_path, bucket, key)
+            report["rejects_path"] = rejects_uri
+            print(f"[ingest] wrote {report['rows_rejected']} rejected row(s) to {rejects_uri}")
+        finally:
+            os.remove(rejects_path)
+
+    return {
+        'statusCode': 200,
+        'body': report
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load API logs into OLTP.api_transactions")
+    parser.add_argument("sources", nargs="+", help="local paths or s3:// URIs (trailing '/' = prefix)")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="input format (default: from file name)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rejects", default="ingest_rejects.ndjson", help="file for rejected rows")
+    parser.add_argument("--skip-duplicates", action="store_true", help="skip log_ids that already exist")
+    parser.add_argument("--assign-log-ids", action="store_true", help="ignore input log_ids")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="processes loading sources in parallel (default INGEST_WORKERS)")
+    args = parser.parse_args(argv)
+    report = ingest(args.sources, fmt=args.format, batch_size=args.batch_size,
+                    rejects_path=args.rejects, skip_duplicates=args.skip_duplicates,
+                    assign_log_ids=args.assign_log_ids, workers=args.workers)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -15,21 +15,40 @@ from sqlalchemy.dialects.postgresql import insert as pg_insert
 import boto3
 from concurrent.futures import ThreadPoolExecutor
 
+from integreat_analytics.metrics import Metrics, run_id_for
+from scripts.integreat.plan_capture import PlanCapture
+from scripts.integreat.schema import provision_indexes
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("Please set DATABASE_URL in your .env")
-
-engine = create_engine(DATABASE_URL, connect_args={"sslmode": "require"}, echo=False)
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+# Fact load parallelism: the day window is split into this many hour-aligned
+# shards, loaded concurrently on up to ETL_FACT_WORKERS connections.
+ETL_FACT_SHARDS  = int(os.getenv("ETL_FACT_SHARDS", "1"))
+ETL_FACT_WORKERS = int(os.getenv("ETL_FACT_WORKERS", str(ETL_FACT_SHARDS)))
+
+# Opt in to creating missing warehouse indexes at the start of each run.
+# Off by default: provision with `python -m scripts.integreat.schema provision`
+# (see schema.py) so a long concurrent build cannot eat the Lambda's timeout.
+PROVISION_INDEXES = os.getenv("PROVISION_INDEXES", "0") == "1"
+
+# Connections the pool keeps; shard threads are capped at this so a large
+# per-run fact_shards cannot outgrow the pool and time out waiting on it
+ETL_POOL_SIZE = max(5, ETL_FACT_WORKERS)
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"sslmode": DATABASE_SSLMODE},
+    pool_size=ETL_POOL_SIZE,
+    echo=False,
+)
 S3 = boto3.client("s3")
 
-# Reflect OLAP dims & fact once
-meta_olap = MetaData(schema="OLAP")
-dim_time = Table("dim_time",            meta_olap, autoload_with=engine)
-dim_loc  = Table("dim_location",        meta_olap, autoload_with=engine)
-dim_user = Table("dim_user",            meta_olap, autoload_with=engine)
-dim_svc  = Table("dim_service",         meta_olap, autoload_with=engine)
-fact     = Table("fact_log_transactions", meta_olap, autoload_with=engine)
+# Opt-in EXPLAIN capture of slow statements (see plan_capture.py)
+plan_capture = PlanCapture(engine)
 
 # Define & create mart tables once (Step 2)
 meta_mart = MetaData(schema="OLAP")
@@ -66,6 +85,17 @@ mart_teleo     = Table("mart_teleo",     meta_mart, *(_common_columns()))
 mart_pillars   = Table("mart_pillars",   meta_mart, *(_common_columns()))
 mart_campus    = Table("mart_campus",    meta_mart, *(_common_columns()))
 mart_evntgarde = Table("mart_evntgarde", meta_mart, *(_common_columns()))
+
+# One row per tenant, bumped in the same transaction as each mart reload;
+# the read API (query_api.py) keys its cache on it
+pipeline_watermarks = Table(
+    "pipeline_watermarks", meta_mart,
+    Column("tenant",     String(50), primary_key=True),
+    Column("date_str",   String(10), nullable=False),
+    Column("run_id",     String(100), nullable=False),
+    Column("rows",       Integer, nullable=False),
+    Column("updated_at", TIMESTAMP, nullable=False),
+)
 meta_mart.create_all(engine)
 
 MART_TABLES = {
@@ -154,12 +184,32 @@ def define_tables():
     meta_olap.create_all(engine)
     return src, dim_time, dim_loc, dim_user, dim_svc, fact
 
-def etl(date_str):
+def _hour_shards(start_dt, end_dt, shards):
+    """
+    Split [start_dt, end_dt) into `shards` disjoint, hour-aligned windows.
+    The shard count is clamped to the number of hours in the window.
+    """
+    hours = int((end_dt - start_dt).total_seconds() // 3600)
+    shards = max(1, min(int(shards), hours))
+    bounds = [start_dt + timedelta(hours=(i * hours) // shards) for i in range(shards)]
+    return list(zip(bounds, bounds[1:] + [end_dt]))
+
+def etl(date_str, fact_shards=None, fact_workers=None, metrics=None):
     """
     Perform the ETL for a single date:
      1) Upsert dims (time, location, user, service)
      2) Insert fact rows, skipping duplicates
     Only rows with created_at between [date_str 00:00, date_str+1 00:00) are processed.
+
+    The fact insert is split into `fact_shards` hour-aligned windows (default
+    ETL_FACT_SHARDS) and run concurrently on `fact_workers` connections
+    (default ETL_FACT_WORKERS, or one per shard when fact_shards is given),
+    never more than ETL_POOL_SIZE; extra shards queue for a free worker.
+    Dims commit before any shard starts; each shard commits on its own, which
+    is safe to re-run since both steps skip rows that already exist.
+
+    Returns a run report with the total and per-shard inserted rows.
+    Stage metrics (dim_upsert, fact_shard, fact_load) go to `metrics`.
     """
     # parse the input date and build our window
     try:
@@ -170,6 +220,7 @@ def etl(date_str):
     start_dt = datetime.combine(dt, time.min)
     end_dt   = start_dt + timedelta(days=1)
     print(f"[etl] Filtering transactions from {start_dt} to {end_dt} (exclusive)")
+    metrics = metrics or Metrics("etl", run_id_for(date_str), Date=date_str)
 
     src, dim_time, dim_loc, dim_user, dim_svc, fact = define_tables()
 
@@ -238,82 +289,121 @@ def etl(date_str):
         .distinct()
     ).on_conflict_do_nothing(constraint="uq_dim_service")
 
-    # 6) Build and execute fact INSERT…SELECT
+    # 6) Build the fact INSERT…SELECT for a created_at window (one per shard)
     hour_part  = func.date_part("hour",  src.c.created_at).cast(Integer)
     day_part   = func.date_part("day",   src.c.created_at).cast(Integer)
     month_part = func.date_part("month", src.c.created_at).cast(Integer)
     year_part  = func.date_part("year",  src.c.created_at).cast(Integer)
 
-    fact_select = (
-        select(
-            src.c.log_id,
-            dim_time.c.time_id,
-            dim_loc.c.location_id,
-            dim_user.c.user_id,
-            dim_svc.c.service_id,
-            src.c.created_at,
-            src.c.request_method,
-            src.c.request_url,
-            src.c.request_headers,
-            src.c.request_body,
-            src.c.response_status_code,
-            src.c.response_body,
-            src.c.execution_time_ms,
-            src.c.error_message
-        )
-        .select_from(
-            src
-            .join(
-                dim_time,
-                (hour_part  == dim_time.c.hour)  &
-                (day_part   == dim_time.c.day)   &
-                (month_part == dim_time.c.month) &
-                (year_part  == dim_time.c.year)
+    def _fact_stmt(window_filter):
+        fact_select = (
+            select(
+                src.c.log_id,
+                dim_time.c.time_id,
+                dim_loc.c.location_id,
+                dim_user.c.user_id,
+                dim_svc.c.service_id,
+                src.c.created_at,
+                src.c.request_method,
+                src.c.request_url,
+                src.c.request_headers,
+                src.c.request_body,
+                src.c.response_status_code,
+                src.c.response_body,
+                src.c.execution_time_ms,
+                src.c.error_message
             )
-            .join(
-                dim_loc,
-                (src.c.country   == dim_loc.c.country)  &
-                (src.c.region    == dim_loc.c.region)   &
-                (src.c.city      == dim_loc.c.city)     &
-                (src.c.zip_code  == dim_loc.c.zip_code) &
-                (src.c.latitude  == dim_loc.c.latitude) &
-                (src.c.longitude == dim_loc.c.longitude)
-            )
-            .join(
-                dim_user,
-                (role_valid  == dim_user.c.role) &
-                (origin_norm == dim_user.c.origin)
-            )
-            .join(
-                dim_svc,
-                (src.c.destination == dim_svc.c.destination) &
-                (src.c.api_version  == dim_svc.c.api_version) &
-                (svc_type           == dim_svc.c.service_type)
+            .select_from(
+                src
+                .join(
+                    dim_time,
+                    (hour_part  == dim_time.c.hour)  &
+                    (day_part   == dim_time.c.day)   &
+                    (month_part == dim_time.c.month) &
+                    (year_part  == dim_time.c.year)
+                )
+                .join(
+                    dim_loc,
+                    (src.c.country   == dim_loc.c.country)  &
+                    (src.c.region    == dim_loc.c.region)   &
+                    (src.c.city      == dim_loc.c.city)     &
+                    (src.c.zip_code  == dim_loc.c.zip_code) &
+                    (src.c.latitude  == dim_loc.c.latitude) &
+                    (src.c.longitude == dim_loc.c.longitude)
+                )
+                .join(
+                    dim_user,
+                    (role_valid  == dim_user.c.role) &
+                    (origin_norm == dim_user.c.origin)
+                )
+                .join(
+                    dim_svc,
+                    (src.c.destination == dim_svc.c.destination) &
+                    (src.c.api_version  == dim_svc.c.api_version) &
+                    (svc_type           == dim_svc.c.service_type)
+                )
             )
+            .where(window_filter)
         )
-        .where(date_filter)
-    )
-
-    fact_stmt = pg_insert(fact).from_select(
-        [
-            "log_id", "time_id", "location_id", "user_id", "service_id", "created_at",
-            "request_method", "request_url", "request_headers", "request_body",
-            "response_status_code", "response_body", "execution_time_ms", "error_message"
-        ],
-        fact_select
-    ).on_conflict_do_nothing(index_elements=["log_id"])
-
 
-    with engine.begin() as conn:
-        conn.execute(time_stmt)
-        conn.execute(loc_stmt)
-        conn.execute(user_stmt)
-        conn.execute(svc_stmt)
-        inserted = conn.execute(fact_stmt).rowcount
-        print(f"[etl] inserted {inserted} fact rows (duplicates skipped)")
+        return pg_insert(fact).from_select(
+            [
+                "log_id", "time_id", "location_id", "user_id", "service_id", "created_at",
+                "request_method", "request_url", "request_headers", "request_body",
+                "response_status_code", "response_body", "execution_time_ms", "error_message"
+            ],
+            fact_select
+        ).on_conflict_do_nothing(index_elements=["log_id"])
+
+    # Dims first, as a barrier: every shard joins against the finished dims
+    with metrics.stage("dim_upsert") as stage:
+        with stage.begin(engine) as conn:
+            for stmt in (time_stmt, loc_stmt, user_stmt, svc_stmt):
+                stage.add("Rows", conn.execute(stmt).rowcount)
+
+    # 7) Load the fact in hour-aligned shards, each on its own connection
+    shards = _hour_shards(start_dt, end_dt, fact_shards or ETL_FACT_SHARDS)
+    if fact_workers is None:
+        fact_workers = ETL_FACT_WORKERS if fact_shards is None else len(shards)
+    workers = max(1, min(len(shards), int(fact_workers), ETL_POOL_SIZE))
+
+    def _load_shard(window):
+        shard_start, shard_end = window
+        with metrics.stage("fact_shard") as stage:
+            stage.note(ShardStart=shard_start.isoformat(), ShardEnd=shard_end.isoformat())
+            with stage.begin(engine) as conn:
+                inserted = conn.execute(_fact_stmt(
+                    (src.c.created_at >= shard_start) & (src.c.created_at < shard_end)
+                )).rowcount
+            stage.add("Rows", inserted)
+        return {
+            "start": shard_start.isoformat(),
+            "end": shard_end.isoformat(),
+            "inserted": inserted,
+            "seconds": round(stage.values["Duration"] / 1000, 3),
+        }
+
+    with metrics.stage("fact_load") as stage:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            shard_reports = list(ex.map(_load_shard, shards))
+        inserted = sum(r["inserted"] for r in shard_reports)
+        stage.add("Rows", inserted)
+        stage.set("Shards", len(shards))
+        stage.set("Workers", workers)
+
+    print(f"[etl] inserted {inserted} fact rows across {len(shards)} shard(s) "
+          f"on {workers} connection(s) (duplicates skipped)")
+    return {
+        "date_str": date_str,
+        "run_id": metrics.run_id,
+        "inserted": inserted,
+        "workers": workers,
+        "seconds": round(stage.values["Duration"] / 1000, 3),
+        "shards": shard_reports,
+    }
 
 #STEP 2 - CREATE DATA MARTS:
-def _load_one_mart(date_str: str, tenant: str) -> int:
+def _load_one_mart(date_str: str, tenant: str, metrics: Metrics = None) -> int:
     tenant_key = tenant.lower()
     dt = datetime.strptime(date_str, "%Y-%m-%d").date()
     start_dt = datetime.combine(dt, time.min)
@@ -349,31 +439,97 @@ def _load_one_mart(date_str: str, tenant: str) -> int:
       AND (LOWER(u.origin) = :tenant_key OR LOWER(s.destination) = :tenant_key)
     """).bindparams(start_dt=start_dt, end_dt=end_dt, tenant_key=tenant_key)
 
-    with engine.begin() as conn:
-        return conn.execute(sql).rowcount
+    metrics = metrics or Metrics("etl", run_id_for(date_str), Date=date_str)
+    with metrics.stage("mart", tenant=tenant_key) as stage:
+        with stage.begin(engine) as conn:
+            inserted = conn.execute(sql).rowcount
+            watermark = {
+                "date_str": date_str,
+                "run_id": metrics.run_id,
+                "rows": inserted,
+                "updated_at": datetime.now(timezone.utc).replace(tzinfo=None),
+            }
+            conn.execute(
+                pg_insert(pipeline_watermarks)
+                .values(tenant=tenant_key, **watermark)
+                .on_conflict_do_update(index_elements=["tenant"], set_=watermark)
+            )
+        stage.add("Rows", inserted)
+    return inserted
 
-def create_data_marts(date_str: str):
+def create_data_marts(date_str: str, metrics: Metrics = None) -> dict:
+    metrics = metrics or Metrics("etl", run_id_for(date_str), Date=date_str)
     def _task(t):
-        cnt = _load_one_mart(date_str, t)
+        cnt = _load_one_mart(date_str, t, metrics)
         print(f"[mart] {t}: inserted {cnt}")
+        return cnt
     with ThreadPoolExecutor(max_workers=4) as ex:
-        ex.map(_task, MART_TABLES)
+        return dict(zip(MART_TABLES, ex.map(_task, MART_TABLES)))
 
 #MAIN ENTRY
-def main(date_override: str = None):
+def main(date_override: str = None, fact_shards: int = None, run_id: str = None,
+         capture_plans: bool = False, stage: str = None, tenant: str = None):
+    """
+    Run the pipeline for one date. `stage` runs a single stage of the nightly
+    DAG (integreat_analytics/nightly_dag.py): "etl" loads the dims and fact
+    only, "mart" reloads the mart of `tenant`. By default both run.
+    """
+    if stage not in (None, "etl", "mart"):
+        raise ValueError(f"Unknown stage '{stage}', expected 'etl' or 'mart'")
+    if stage == "mart" and (tenant or "").lower() not in MART_TABLES:
+        raise ValueError(f"stage 'mart' needs a tenant, one of {sorted(MART_TABLES)}")
+
     date_str = date_override or (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
-    print(f"[MAIN] pipeline for {date_str}")
-    etl(date_str)
-    create_data_marts(date_str)
+    metrics = Metrics("etl", run_id_for(date_str, run_id), Date=date_str)
+    print(f"[MAIN] {stage or 'pipeline'} for {date_str} (run {metrics.run_id})")
+
+    window_start = datetime.strptime(date_str, "%Y-%m-%d")
+    plan_capture.start_run(metrics.run_id, window_start, window_start + timedelta(days=1),
+                           force=capture_plans)
+    if PROVISION_INDEXES and stage != "mart":
+        with metrics.stage("provision_indexes") as s:
+            define_tables()
+            s.add("Created", len(provision_indexes(engine, MART_TABLES)))
+    try:
+        with metrics.stage("pipeline") as s:
+            if stage == "mart":
+                report = {"date_str": date_str, "run_id": metrics.run_id,
+                          "marts": {tenant.lower(): _load_one_mart(date_str, tenant, metrics)}}
+            else:
+                report = etl(date_str, fact_shards=fact_shards, metrics=metrics)
+                s.add("Rows", report["inserted"])
+                if stage is None:
+                    report["marts"] = create_data_marts(date_str, metrics)
+    finally:
+        if plan_capture.active:
+            # Diagnostics only: a failed flush must not replace the pipeline's own error
+            try:
+                with metrics.stage("plan_capture") as s:
+                    s.add("Plans", len(plan_capture.flush()))
+            except Exception:
+                print("[plans] plan capture failed:")
+                traceback.print_exc()
     print("[MAIN] done")
+    return report
 
 def ETL_Handler(event, context):
     """
     AWS Lambda handler for Integreat ETL pipeline.
-    Accepts optional 'date_str' in the event to override the date.
+    Accepts optional 'date_str' in the event to override the date,
+    optional 'fact_shards' to override ETL_FACT_SHARDS for this run, and
+    optional 'run_id' to tag the metrics (defaults to nightly-<date_str>), and
+    optional 'capture_plans' to capture the plans of this run's statements.
+    The nightly state machine passes 'stage' ("etl", or "mart" with a
+    'tenant') to run one stage at a time; without it the whole pipeline runs.
     """
-    date_str = event.get('date_str') if event else None
-    main(date_str)
+    event = event or {}
+    report = main(event.get('date_str'), event.get('fact_shards'), event.get('run_id'),
+                  bool(event.get('capture_plans', False)),
+                  event.get('stage'), event.get('tenant'))
+    return {
+        'statusCode': 200,
+        'body': report
+    }
 
 if __name__ == "__main__":
     arg = sys.argv[1] if len(sys.argv) > 1 else None
@@ -0,0 +1,135 @@
+"""
+orchestrator.py
+
+Local, in-process runner for the nightly DAG (integreat_analytics/nightly_dag.py).
+
+Runs the same graph as the Step Functions state machine: the ETL, then each
+tenant's mart reload and export, on a bounded thread pool. Tasks are retried
+with the backoff from their StageSpec; when a task fails for good its
+dependents are skipped, and the other tenants carry on. Each task emits an
+"orchestrator" metrics stage with its Retries.
+
+Usage (from the repo root):
+    python -m scripts.integreat.orchestrator 2024-03-21
+    python -m scripts.integreat.orchestrator 2024-03-21 --max-concurrency 4 --tenants teleo,campus
+"""
+
+import sys
+import traceback
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone, timedelta
+from time import perf_counter
+
+from integreat_analytics.metrics import Metrics, run_id_for
+from integreat_analytics.nightly_dag import MAX_CONCURRENCY, TENANTS, build_dag, validate
+
+def _run_task(task, runner, metrics, sleep):
+    """Run one task with retries; returns its result record instead of raising."""
+    started = perf_counter()
+    attempts = 0
+    with metrics.stage(task.kind, tenant=task.tenant) as stage:
+        while True:
+            attempts += 1
+            try:
+                result = runner(task)
+                status, error = "ok", None
+                break
+            except Exception as e:
+                if attempts > task.spec.retries:
+                    print(f"[dag] {task.name} failed after {attempts} attempt(s): {e}")
+                    stage.set("Failed", 1)
+                    status, error, result = "failed", str(e), None
+                    break
+                delay = task.spec.delay(attempts)
+                print(f"[dag] {task.name} attempt {attempts} failed ({e}); retrying in {delay:g}s")
+                stage.add("Retries")
+                sleep(delay)
+    return {"status": status, "attempts": attempts, "seconds": round(perf_counter() - started, 3),
+            "result": result, "error": error}
+
+def run_dag(tasks, runners, max_concurrency=MAX_CONCURRENCY, metrics=None, sleep=time.sleep):
+    """
+    Execute `tasks` respecting depends_on, with at most `max_concurrency`
+    tasks in flight. `runners` maps a task kind to a callable taking the
+    task. Returns {task name: result record}.
+    """
+    metrics = metrics or Metrics("orchestrator")
+    results = {}
+    # Dependency order, so one pass skips a failed task's whole subtree
+    pending = {t.name: t for t in validate(tasks)}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while pending or running:
+            for task in list(pending.values()):
+                if any(results.get(d, {}).get("status") in ("failed", "skipped") for d in task.depends_on):
+                    print(f"[dag] {task.name} skipped: an upstream task failed")
+                    results[task.name] = {"status": "skipped", "attempts": 0, "seconds": 0.0,
+                                          "result": None, "error": None}
+                    del pending[task.name]
+
+            # Tasks come in DAG order, so a ready export runs before the next
+            # tenant's mart and finished tenants are delivered first
+            ready = [t for t in pending.values()
+                     if all(results.get(d, {}).get("status") == "ok" for d in t.depends_on)]
+            for task in ready[:max_concurrency - len(running)]:
+                running[pool.submit(_run_task, task, runners[task.kind], metrics, sleep)] = task
+                del pending[task.name]
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future).name] = future.result()
+    return {t.name: results[t.name] for t in tasks}
+
+def local_runners(date_str, run_id=None, fact_shards=None):
+    """Runners that call the pipeline and the tenant export in-process."""
+    from scripts.integreat import integreat_pipeline as pipeline
+    from integreat_analytics.template import tenant_handler_template as template
+
+    metrics = Metrics("etl", run_id_for(date_str, run_id), Date=date_str)
+    return {
+        "etl": lambda task: pipeline.main(date_str, fact_shards, metrics.run_id, stage="etl")["inserted"],
+        "mart": lambda task: pipeline._load_one_mart(date_str, task.tenant, metrics),
+        "export": lambda task: template.export_and_upload(date_str, task.tenant, run_id=metrics.run_id),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the nightly DAG locally")
+    parser.add_argument("date", nargs="?", help="YYYY-MM-DD (default: yesterday, UTC)")
+    parser.add_argument("--tenants", default=",".join(TENANTS), help="comma-separated tenants")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--fact-shards", type=int)
+    parser.add_argument("--run-id")
+    args = parser.parse_args(argv)
+
+    date_str = args.date or (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    run_id = run_id_for(date_str, args.run_id)
+    tenants = [t.strip().lower() for t in args.tenants.split(",") if t.strip()]
+    # Reject before the ETL runs; the mart stage also builds a table name from it
+    unknown = sorted(set(tenants) - set(TENANTS))
+    if unknown or not tenants:
+        parser.error(f"--tenants: expected some of {', '.join(TENANTS)}, got {', '.join(unknown) or 'none'}")
+
+    started = perf_counter()
+    results = run_dag(build_dag(tenants), local_runners(date_str, run_id, args.fact_shards),
+                      max_concurrency=args.max_concurrency,
+                      metrics=Metrics("orchestrator", run_id, Date=date_str))
+
+    print()
+    print(f"{'task':<20} {'status':<8} {'attempts':>8} {'seconds':>8} {'rows':>10}")
+    for name, r in results.items():
+        rows = r["result"] if r["result"] is not None else "-"
+        print(f"{name:<20} {r['status']:<8} {r['attempts']:>8} {r['seconds']:>8.2f} {rows!s:>10}")
+    print(f"\n[dag] {date_str} finished in {perf_counter() - started:.2f}s (run {run_id})")
+    return 0 if all(r["status"] == "ok" for r in results.values()) else 1
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
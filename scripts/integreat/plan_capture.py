@@ -0,0 +1,365 @@
+"""
+plan_capture.py
+
+Opt-in query-plan capture for slow pipeline statements.
+
+A PlanCapture hooks the pipeline's shared engine and times every statement.
+When a statement runs longer than PLAN_CAPTURE_THRESHOLD_MS (or the whole run
+is sampled, PLAN_CAPTURE_SAMPLE_RATE, or forced with `capture_plans` in the
+ETL event) it is queued. At the end of the run, flush() explains the slowest
+queued statements inside a transaction that is always rolled back, and stores
+each plan together with the observed duration, the run ID and the date window.
+
+Reads are explained with `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`. Writes
+(INSERT / UPDATE / DELETE, including data-modifying WITH) get a plain
+`EXPLAIN (FORMAT JSON)`: by flush time their effects are committed, so an
+ANALYZE re-run would measure a different statement (every fact row hitting
+ON CONFLICT, a DELETE finding nothing). Their execution_ms is left empty;
+observed_ms is the real duration.
+
+flush() runs in the pipeline's Lambda, so it is bounded: at most
+PLAN_CAPTURE_MAX_STATEMENTS distinct statements (slowest first), each under
+PLAN_CAPTURE_TIMEOUT_MS, and all within PLAN_CAPTURE_BUDGET_MS. Statements
+left over when the budget runs out are skipped and counted in the log.
+
+Plans are stored in OLAP.pipeline_plan_diagnostics, or as JSON objects under
+an S3 prefix when PLAN_CAPTURE_SINK is an s3:// URI.
+
+CLI (from the repo root):
+    python -m scripts.integreat.plan_capture list [--run RUN_ID]
+    python -m scripts.integreat.plan_capture diff RUN_A RUN_B [--label fact_log_transactions]
+"""
+
+import sys
+import traceback
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from time import perf_counter
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Float, Text, TIMESTAMP,
+    event, select,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+import boto3
+
+PLAN_CAPTURE_THRESHOLD_MS = os.getenv("PLAN_CAPTURE_THRESHOLD_MS")
+PLAN_CAPTURE_SAMPLE_RATE = float(os.getenv("PLAN_CAPTURE_SAMPLE_RATE", "0"))
+PLAN_CAPTURE_TIMEOUT_MS = int(os.getenv("PLAN_CAPTURE_TIMEOUT_MS", "30000"))
+PLAN_CAPTURE_BUDGET_MS = int(os.getenv("PLAN_CAPTURE_BUDGET_MS", "120000"))
+PLAN_CAPTURE_MAX_STATEMENTS = int(os.getenv("PLAN_CAPTURE_MAX_STATEMENTS", "20"))
+PLAN_CAPTURE_SINK = os.getenv("PLAN_CAPTURE_SINK", "table")
+
+_CAPTURED_VERBS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+_WRITE_VERBS = ("INSERT", "UPDATE", "DELETE")
+_WRITE_RE = re.compile(r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\b", re.IGNORECASE)
+_TARGET_RE = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|FROM)\s+(?:"?\w+"?\.)?"?(\w+)"?', re.IGNORECASE)
+
+meta_diag = MetaData(schema="OLAP")
+plan_diagnostics = Table(
+    "pipeline_plan_diagnostics", meta_diag,
+    Column("plan_id",        Integer, primary_key=True),
+    Column("captured_at",    TIMESTAMP, nullable=False),
+    Column("run_id",         String(100), nullable=False),
+    Column("label",          String(100), nullable=False),
+    Column("statement_hash", String(32), nullable=False),
+    Column("statement",      Text, nullable=False),
+    Column("window_start",   TIMESTAMP),
+    Column("window_end",     TIMESTAMP),
+    Column("reason",         String(20), nullable=False),
+    Column("observed_ms",    Float, nullable=False),
+    Column("planning_ms",    Float),
+    Column("execution_ms",   Float),
+    Column("plan",           JSONB, nullable=False),
+)
+
+def statement_label(statement):
+    """A stable, readable label for a statement: its first target table."""
+    match = _TARGET_RE.search(statement)
+    return match.group(1) if match else "statement"
+
+def is_write(statement):
+    """True for statements whose effects an EXPLAIN ANALYZE re-run would repeat."""
+    head = statement.lstrip().upper()
+    return head.startswith(_WRITE_VERBS) or (head.startswith("WITH") and bool(_WRITE_RE.search(statement)))
+
+def select_for_explain(pending, limit=PLAN_CAPTURE_MAX_STATEMENTS):
+    """The slowest `limit` queued statements, one entry per distinct statement."""
+    slowest = {}
+    for item in pending:
+        key = statement_hash(item["statement"])
+        if key not in slowest or item["observed_ms"] > slowest[key]["observed_ms"]:
+            slowest[key] = item
+    return sorted(slowest.values(), key=lambda item: item["observed_ms"], reverse=True)[:limit]
+
+def statement_hash(statement):
+    normalized = " ".join(statement.split())
+    return hashlib.md5(normalized.encode("utf-8")).hexdigest()
+
+class PlanCapture:
+    """Times statements on `engine` and captures plans for the slow ones."""
+
+    def __init__(self, engine, threshold_ms=PLAN_CAPTURE_THRESHOLD_MS,
+                 sample_rate=PLAN_CAPTURE_SAMPLE_RATE, sink=PLAN_CAPTURE_SINK,
+                 max_statements=PLAN_CAPTURE_MAX_STATEMENTS, budget_ms=PLAN_CAPTURE_BUDGET_MS,
+                 timeout_ms=PLAN_CAPTURE_TIMEOUT_MS):
+        self.engine = engine
+        self.threshold_ms = float(threshold_ms) if threshold_ms not in (None, "") else None
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.max_statements = max_statements
+        self.budget_ms = budget_ms
+        self.timeout_ms = timeout_ms
+        self.active = False
+        self.sampled = False
+        self.run_id = None
+        self.window = (None, None)
+        self._pending = []
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def start_run(self, run_id, window_start=None, window_end=None, force=False):
+        """Arm capture for one pipeline run; `force` captures every statement."""
+        self.sampled = force or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        self.active = self.sampled or self.threshold_ms is not None
+        self.run_id = run_id
+        self.window = (window_start, window_end)
+        with self._lock:
+            self._pending = []
+        if self.active:
+            reason = "sampled" if self.sampled else f">= {self.threshold_ms:g} ms"
+            print(f"[plans] capturing plans for run {run_id} ({reason})")
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            conn.info.setdefault("plan_capture_started", []).append(perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.active:
+            return
+        started = conn.info.get("plan_capture_started")
+        if not started:
+            return
+        observed_ms = (perf_counter() - started.pop()) * 1000
+        if executemany or not statement.lstrip().upper().startswith(_CAPTURED_VERBS):
+            return
+        if "pg_catalog" in statement or "information_schema" in statement:
+            return  # reflection / create_all checks
+        slow = self.threshold_ms is not None and observed_ms >= self.threshold_ms
+        if slow or self.sampled:
+            with self._lock:
+                self._pending.append({
+                    "statement": statement,
+                    "parameters": parameters,
+                    "observed_ms": observed_ms,
+                    "reason": "threshold" if slow else "sampled",
+                })
+
+    def flush(self):
+        """Explain the slowest queued statements, within budget, and store the plans."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return []
+
+        selected = select_for_explain(pending, self.max_statements)
+        deadline = perf_counter() + self.budget_ms / 1000
+        captured, skipped = [], 0
+        raw_conn = self.engine.raw_connection()
+        try:
+            for item in selected:
+                remaining_ms = int((deadline - perf_counter()) * 1000)
+                if remaining_ms <= 0:
+                    skipped += 1
+                    continue
+                analyze = not is_write(item["statement"])
+                options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+                try:
+                    with raw_conn.cursor() as cur:
+                        cur.execute(f"SET LOCAL statement_timeout = {min(self.timeout_ms, remaining_ms)}")
+                        cur.execute(f"EXPLAIN ({options}) " + item["statement"], item["parameters"])
+                        plan = cur.fetchone()[0]
+                except Exception as e:
+                    print(f"[plans] could not explain {statement_label(item['statement'])}: {e}")
+                    continue
+                finally:
+                    # EXPLAIN ANALYZE really executes the statement: never keep its effects
+                    raw_conn.rollback()
+                plan = plan[0] if isinstance(plan, list) else plan
+                captured.append({
+                    "captured_at": datetime.now(timezone.utc).replace(tzinfo=None),
+                    "run_id": self.run_id,
+                    "label": statement_label(item["statement"]),
+                    "statement_hash": statement_hash(item["statement"]),
+                    "statement": item["statement"],
+                    "window_start": self.window[0],
+                    "window_end": self.window[1],
+                    "reason": item["reason"],
+                    "observed_ms": round(item["observed_ms"], 3),
+                    "planning_ms": plan.get("Planning Time"),
+                    "execution_ms": plan.get("Execution Time"),
+                    "plan": plan,
+                })
+        finally:
+            raw_conn.close()
+
+        distinct = len({statement_hash(item["statement"]) for item in pending})
+        dropped = distinct - len(selected)
+        if skipped or dropped:
+            print(f"[plans] skipped {skipped} statement(s) over the {self.budget_ms} ms budget "
+                  f"and {dropped} beyond the {self.max_statements} slowest")
+        self._store(captured)
+        print(f"[plans] stored {len(captured)} plan(s) for run {self.run_id}")
+        return captured
+
+    def _store(self, captured):
+        if not captured:
+            return
+        if self.sink.startswith("s3://"):
+            bucket, _, prefix = self.sink[len("s3://"):].partition("/")
+            s3 = boto3.client("s3")
+            for row in captured:
+                key = f"{prefix.rstrip('/')}/{row['run_id']}/{row['label']}-{row['statement_hash']}.json"
+                s3.put_object(Bucket=bucket, Key=key.lstrip("/"),
+                              Body=json.dumps(row, default=str).encode("utf-8"),
+                              ContentType="application/json")
+        else:
+            meta_diag.create_all(self.engine)
+            with self.engine.begin() as conn:
+                conn.execute(plan_diagnostics.insert(), captured)
+
+# --- Diffing --------------------------------------------------------------
+
+def _walk(node, depth=0):
+    yield depth, node
+    for child in node.get("Plans", []):
+        yield from _walk(child, depth + 1)
+
+def plan_shape(plan):
+    """One line per plan node without numbers, so runs can be diffed by shape."""
+    lines = []
+    for depth, node in _walk(plan["Plan"]):
+        target = node.get("Index Name") or node.get("Relation Name") or ""
+        lines.append("  " * depth + node["Node Type"] + (f" on {target}" if target else ""))
+    return lines
+
+def plan_summary(plan):
+    """
+    Numbers worth comparing between two runs of the same statement. Writes
+    are captured with a plain EXPLAIN, so they only have the planner's
+    estimates; the timings and buffers come from EXPLAIN ANALYZE plans.
+    """
+    root = plan["Plan"]
+    nodes = [node for _, node in _walk(root)]
+    summary = {
+        "total_cost": root.get("Total Cost"),
+        "estimated_rows": root.get("Plan Rows"),
+    }
+    if "Execution Time" in plan:
+        summary.update({
+            "execution_ms": plan["Execution Time"],
+            "planning_ms": plan.get("Planning Time"),
+            "actual_rows": root.get("Actual Rows"),
+            "shared_hit_blocks": sum(n.get("Shared Hit Blocks", 0) for n in nodes),
+            "shared_read_blocks": sum(n.get("Shared Read Blocks", 0) for n in nodes),
+            "temp_written_blocks": sum(n.get("Temp Written Blocks", 0) for n in nodes),
+        })
+    summary["seq_scans"] = sum(1 for n in nodes if n["Node Type"] == "Seq Scan")
+    return summary
+
+def diff_plans(plan_a, plan_b, name_a="a", name_b="b", observed_a=None, observed_b=None):
+    """
+    Return printable lines comparing two captured plans. `observed_a` /
+    `observed_b` are the stored observed_ms, the only real timing for writes.
+    """
+    lines = []
+    sum_a = {"observed_ms": observed_a, **plan_summary(plan_a)}
+    sum_b = {"observed_ms": observed_b, **plan_summary(plan_b)}
+    for key in list(sum_a) + [k for k in sum_b if k not in sum_a]:
+        a, b = sum_a.get(key), sum_b.get(key)
+        if a is None and b is None:
+            continue
+        change = f" ({(b - a) / a:+.0%})" if a and b is not None else ""
+        lines.append(f"  {key:<20} {a!s:>14} -> {b!s:<14}{change}")
+    shape = list(difflib.unified_diff(plan_shape(plan_a), plan_shape(plan_b),
+                                      fromfile=name_a, tofile=name_b, lineterm="", n=2))
+    lines.append("  plan shape: " + ("changed" if shape else "unchanged"))
+    lines.extend("    " + line for line in shape)
+    return lines
+
+def _load_plans(engine, run_id=None, sink=PLAN_CAPTURE_SINK):
+    """Fetch captured plans (newest first) from the configured sink."""
+    if sink.startswith("s3://"):
+        bucket, _, prefix = sink[len("s3://"):].partition("/")
+        prefix = prefix.rstrip("/") + "/" + (f"{run_id}/" if run_id else "")
+        s3 = boto3.client("s3")
+        rows = []
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix.lstrip("/")):
+            for obj in page.get("Contents", []):
+                rows.append(json.loads(s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()))
+        return sorted(rows, key=lambda r: r["captured_at"], reverse=True)
+
+    query = select(plan_diagnostics).order_by(plan_diagnostics.c.captured_at.desc())
+    if run_id:
+        query = query.where(plan_diagnostics.c.run_id == run_id)
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(query)]
+
+def main(argv=None):
+    from scripts.integreat.integreat_pipeline import engine
+
+    parser = argparse.ArgumentParser(description="Inspect and diff captured pipeline query plans")
+    sub = parser.add_subparsers(dest="command", required=True)
+    list_cmd = sub.add_parser("list", help="list captured plans")
+    list_cmd.add_argument("--run", help="only this run ID")
+    diff_cmd = sub.add_parser("diff", help="compare the plans of two runs")
+    diff_cmd.add_argument("run_a")
+    diff_cmd.add_argument("run_b")
+    diff_cmd.add_argument("--label", help="only statements with this label (e.g. mart_campus)")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for row in _load_plans(engine, args.run):
+            # Writes are not re-executed, so they have no execution_ms
+            executed = f"{row['execution_ms']:.0f}ms" if row["execution_ms"] is not None else "-"
+            print(f"{row['captured_at']!s:<27} {row['run_id']:<24} {row['label']:<26} "
+                  f"observed={row['observed_ms']:.0f}ms exec={executed} "
+                  f"[{row['reason']}]")
+        return 0
+
+    def _latest(rows):
+        latest = {}
+        for row in rows:  # newest first, so the first per key wins
+            if args.label and row["label"] != args.label:
+                continue
+            latest.setdefault((row["label"], row["statement_hash"]), row)
+        return latest
+
+    plans_a = _latest(_load_plans(engine, args.run_a))
+    plans_b = _latest(_load_plans(engine, args.run_b))
+    for key in sorted(set(plans_a) | set(plans_b)):
+        label, digest = key
+        print(f"== {label} [{digest[:8]}]")
+        if key not in plans_a or key not in plans_b:
+            print(f"  only captured in {args.run_a if key in plans_a else args.run_b}")
+            continue
+        row_a, row_b = plans_a[key], plans_b[key]
+        for line in diff_plans(row_a["plan"], row_b["plan"], args.run_a, args.run_b,
+                               row_a["observed_ms"], row_b["observed_ms"]):
+            print(line)
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
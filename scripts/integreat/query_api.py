@@ -0,0 +1,352 @@
+"""
+query_api.py
+
+Read-only, cached query API over the tenant marts for dashboards.
+
+A query names a time range, group-by dimensions and metrics:
+
+    {"tenant": "teleo", "start": "2024-03-01", "end": "2024-03-08",
+     "group_by": ["day", "country"], "metrics": ["requests", "errors"],
+     "filters": {"request_method": "GET"}, "limit": 500}
+
+Only whitelisted dimensions and metrics are accepted, and the SQL is built
+with SQLAlchemy Core over the caller's own mart (OLAP.mart_<tenant>), so a
+tenant can never read another tenant's rows. Behind API Gateway, the tenant
+comes from the authorizer's `custom:tenant` claim, and a different tenant in
+the body is refused; direct (IAM-authorized) invocations name the tenant in
+the event.
+
+Results are kept in a bounded LRU cache with a TTL. The cache key includes
+the tenant's watermark in OLAP.pipeline_watermarks, which the pipeline bumps
+in the same transaction as each mart reload. A reload therefore invalidates
+that tenant's cached results. The watermark itself is re-read at most every
+QUERY_WATERMARK_TTL_SECONDS, so repeated dashboard refreshes are answered
+from memory without touching Postgres.
+
+CLI (from the repo root):
+    python -m scripts.integreat.query_api --tenant teleo --start 2024-03-01 --end 2024-03-08 \\
+        --group-by day,country --metrics requests,errors,p95_execution_ms --repeat 3
+"""
+
+import sys
+import traceback
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
+from time import monotonic, perf_counter
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, MetaData, Table, select, func, text, and_, or_
+
+from integreat_analytics.metrics import Metrics
+from integreat_analytics.nightly_dag import TENANTS
+
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise RuntimeError("Please set DATABASE_URL in your .env")
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "900"))
+QUERY_WATERMARK_TTL_SECONDS = float(os.getenv("QUERY_WATERMARK_TTL_SECONDS", "30"))
+QUERY_MAX_DAYS = int(os.getenv("QUERY_MAX_DAYS", "400"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+
+engine = create_engine(DATABASE_URL, connect_args={"sslmode": DATABASE_SSLMODE}, echo=False)
+
+TIME_BUCKETS = ("hour", "day", "week", "month")
+DIMENSIONS = (
+    "country", "region", "city", "role", "origin", "destination",
+    "api_version", "service_type", "request_method", "response_status_code",
+)
+
+def _metric_exprs(mart):
+    is_error = or_(mart.c.response_status_code >= 400, mart.c.error_message.isnot(None))
+    return {
+        "requests":         func.count(),
+        "errors":           func.count().filter(is_error),
+        "avg_execution_ms": func.avg(mart.c.execution_time_ms),
+        "p95_execution_ms": func.percentile_cont(0.95).within_group(mart.c.execution_time_ms),
+        "max_execution_ms": func.max(mart.c.execution_time_ms),
+    }
+
+METRICS = ("requests", "errors", "avg_execution_ms", "p95_execution_ms", "max_execution_ms")
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+RESULTS = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+WATERMARKS = TTLCache(len(TENANTS) * 2, QUERY_WATERMARK_TTL_SECONDS)
+
+_MART_TABLES = {}
+_MART_TABLES_LOCK = threading.Lock()
+
+def _mart(tenant):
+    """The tenant's mart table (reflected once per process)."""
+    with _MART_TABLES_LOCK:
+        if tenant not in _MART_TABLES:
+            _MART_TABLES[tenant] = Table(f"mart_{tenant}", MetaData(schema="OLAP"), autoload_with=engine)
+        return _MART_TABLES[tenant]
+
+def watermark(tenant):
+    """The tenant's last mart reload ("<run_id>@<updated_at>"), cached briefly."""
+    cached = WATERMARKS.get(tenant)
+    if cached is not None:
+        return cached
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            'SELECT run_id, updated_at FROM "OLAP".pipeline_watermarks WHERE tenant = :tenant'
+        ), {"tenant": tenant}).first()
+    value = f"{row.run_id}@{row.updated_at.isoformat()}" if row else "none"
+    WATERMARKS.set(tenant, value)
+    return value
+
+def _parse_time(value, name):
+    """Parse an ISO date/timestamp as naive UTC, the way the marts store created_at."""
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"{name}: expected YYYY-MM-DD or an ISO timestamp, got {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Column type of each filterable dimension (everything else is varchar)
+_INT_DIMENSIONS = ("response_status_code",)
+
+def _filter_value(value, column):
+    """Convert one filter value to its column's type, so Postgres never sees a mismatch."""
+    if isinstance(value, bool):
+        raise ValueError(f"filters.{column}: expected a string or number, got {value!r}")
+    if column not in _INT_DIMENSIONS:
+        if not isinstance(value, (str, int, float)):
+            raise ValueError(f"filters.{column}: expected a value or a non-empty list of values")
+        return str(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    raise ValueError(f"filters.{column}: expected an integer, got {value!r}")
+
+def _name_list(value, name):
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"{name}: expected a list of names")
+    return list(value)
+
+def _filter_values(value, column):
+    values = list(value) if isinstance(value, (list, tuple)) else [value]
+    if not values:
+        raise ValueError(f"filters.{column}: expected a value or a non-empty list of values")
+    return sorted(_filter_value(v, column) for v in values)
+
+def normalize(query):
+    """Validate a query and return it in canonical form (also the cache key)."""
+    if not isinstance(query, dict):
+        raise ValueError("query: expected a JSON object")
+    tenant = str(query.get("tenant") or "").lower()
+    if tenant not in TENANTS:
+        raise ValueError(f"tenant: expected one of {list(TENANTS)}")
+
+    start = _parse_time(query.get("start"), "start")
+    end = _parse_time(query.get("end"), "end") if query.get("end") else start + timedelta(days=1)
+    if end <= start:
+        raise ValueError("end must be after start")
+    if end - start > timedelta(days=QUERY_MAX_DAYS):
+        raise ValueError(f"time range is limited to {QUERY_MAX_DAYS} days")
+
+    group_by = _name_list(query.get("group_by"), "group_by")
+    unknown = [g for g in group_by if g not in TIME_BUCKETS + DIMENSIONS]
+    if unknown or len(group_by) != len(set(group_by)):
+        raise ValueError(f"group_by: expected distinct values from {list(TIME_BUCKETS + DIMENSIONS)}")
+    if sum(g in TIME_BUCKETS for g in group_by) > 1:
+        raise ValueError(f"group_by: at most one of {list(TIME_BUCKETS)}")
+
+    metrics = _name_list(query.get("metrics"), "metrics") or ["requests"]
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown or len(metrics) != len(set(metrics)):
+        raise ValueError(f"metrics: expected distinct values from {list(METRICS)}")
+
+    raw_filters = query.get("filters") or {}
+    if not isinstance(raw_filters, dict):
+        raise ValueError("filters: expected an object of column -> value(s)")
+    filters = {}
+    for column, value in sorted(raw_filters.items()):
+        if column not in DIMENSIONS:
+            raise ValueError(f"filters: expected keys from {list(DIMENSIONS)}")
+        filters[column] = _filter_values(value, column)
+
+    limit = query.get("limit") or 1000
+    if isinstance(limit, str) and limit.strip().lstrip("-").isdigit():
+        limit = int(limit)
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= QUERY_MAX_ROWS:
+        raise ValueError(f"limit: expected 1..{QUERY_MAX_ROWS}")
+
+    return {
+        "tenant": tenant, "start": start.isoformat(), "end": end.isoformat(),
+        "group_by": group_by, "metrics": metrics, "filters": filters, "limit": limit,
+    }
+
+def build_statement(q):
+    """The SELECT for a normalized query, over the tenant's mart only."""
+    mart = _mart(q["tenant"])
+    keys = [
+        func.date_trunc(g, mart.c.created_at).label(g) if g in TIME_BUCKETS else mart.c[g]
+        for g in q["group_by"]
+    ]
+    exprs = _metric_exprs(mart)
+    where = [
+        mart.c.created_at >= datetime.fromisoformat(q["start"]),
+        mart.c.created_at < datetime.fromisoformat(q["end"]),
+    ]
+    where += [mart.c[column].in_(values) for column, values in q["filters"].items()]
+    return (
+        select(*keys, *(exprs[m].label(m) for m in q["metrics"]))
+        .where(and_(*where))
+        .group_by(*keys)
+        .order_by(*keys)
+        .limit(q["limit"])
+    )
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def run_query(query):
+    """Answer a query from the cache, or from Postgres on a miss."""
+    q = normalize(query)
+    started = perf_counter()
+    mark = watermark(q["tenant"])
+    key = (mark, json.dumps(q, sort_keys=True))
+
+    with Metrics("query_api").stage("query", tenant=q["tenant"]) as stage:
+        result = RESULTS.get(key)
+        cached = result is not None
+        if not cached:
+            with stage.connect(engine) as conn:
+                rows = conn.execute(build_statement(q))
+                columns = list(rows.keys())
+                data = [[_json_value(v) for v in row] for row in rows]
+            result = {"columns": columns, "rows": data, "watermark": mark}
+            RESULTS.set(key, result)
+            stage.add("CacheMiss")
+        else:
+            stage.add("CacheHit")
+        stage.add("Rows", len(result["rows"]))
+
+    return {**result, "cached": cached,
+            "ms": round((perf_counter() - started) * 1000, 3)}
+
+def _caller_tenant(event):
+    """The tenant asserted by the API Gateway authorizer, if any."""
+    authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+    claims = authorizer.get("claims") or (authorizer.get("jwt") or {}).get("claims") or {}
+    return claims.get("custom:tenant")
+
+def Query_Handler(event, context):
+    """
+    AWS Lambda handler for the read API. Accepts an API Gateway proxy event
+    (query as JSON body) or a direct invocation with the query as the event.
+    """
+    event = event or {}
+    via_api = "body" in event
+    try:
+        query = json.loads(event["body"] or "{}") if via_api else dict(event)
+        if not isinstance(query, dict):
+            raise ValueError("query: expected a JSON object")
+        caller = _caller_tenant(event)
+        if caller:
+            if query.get("tenant") and str(query["tenant"]).lower() != caller.lower():
+                raise PermissionError("tenant does not match the caller")
+            query["tenant"] = caller
+        elif via_api:
+            raise PermissionError("no tenant claim on the request")
+        status, body = 200, run_query(query)
+    except PermissionError as e:
+        status, body = 403, {"error": str(e)}
+    except ValueError as e:
+        status, body = 400, {"error": str(e)}
+
+    if via_api:
+        return {"statusCode": status, "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(body, default=str)}
+    return {"statusCode": status, "body": body}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query a tenant mart through the cached read API")
+    parser.add_argument("--tenant", required=True)
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD or ISO timestamp")
+    parser.add_argument("--end", help="exclusive (default: start + 1 day)")
+    parser.add_argument("--group-by", default="", help=f"comma-separated, from {', '.join(TIME_BUCKETS + DIMENSIONS)}")
+    parser.add_argument("--metrics", default="requests", help=f"comma-separated, from {', '.join(METRICS)}")
+    parser.add_argument("--filter", action="append", default=[], metavar="COLUMN=VALUE")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=1, help="run the query N times to show the cache")
+    args = parser.parse_args(argv)
+
+    filters = {}
+    for item in args.filter:
+        column, _, value = item.partition("=")
+        filters.setdefault(column, []).append(value)
+    query = {
+        "tenant": args.tenant, "start": args.start, "end": args.end,
+        "group_by": [g for g in args.group_by.split(",") if g],
+        "metrics": [m for m in args.metrics.split(",") if m],
+        "filters": filters, "limit": args.limit,
+    }
+    for i in range(args.repeat):
+        result = run_query(query)
+        if i == 0:
+            print(json.dumps({"columns": result["columns"], "rows": result["rows"]}, default=str, indent=2))
+        print(f"[query] run {i + 1}: {len(result['rows'])} rows in {result['ms']:.1f} ms "
+              f"({'cache' if result['cached'] else 'postgres'}, watermark {result['watermark']})")
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
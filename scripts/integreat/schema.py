@@ -0,0 +1,154 @@
+"""
+schema.py
+
+Index declarations for the warehouse and an idempotent provisioner.
+
+define_tables() and the mart tables only declare primary keys and the
+uq_dim_* constraints, so every created_at window filter in the pipeline
+(the dim upserts and fact insert over OLTP.api_transactions, the mart
+reloads over the fact and the marts, the tenant export query) was a
+sequential scan. INDEXES lists what those queries need:
+
+- BRIN on OLTP.api_transactions.created_at: the log is append-only and
+  naturally ordered by time, so a BRIN index stays tiny and cheap to
+  maintain on the hottest write path
+- B-tree on created_at for the fact and every mart (day-window reads,
+  the mart delete-and-reload, the export query)
+- B-tree on the fact's foreign keys (joins and dim maintenance)
+- Expression indexes on LOWER(origin) / LOWER(destination), the tenant
+  filter used by the mart load
+
+provision_indexes() creates whatever is missing with CREATE INDEX
+CONCURRENTLY, rebuilds indexes left invalid by an interrupted concurrent
+build, and skips tables that do not exist yet. An index that another session
+is still building (pg_stat_progress_create_index) is also invalid until it
+finishes; it is reported as 'building' and left alone.
+
+A concurrent build on a large table can outlast a Lambda invocation, so run
+this from the CLI or a deploy step rather than from the nightly pipeline
+(PROVISION_INDEXES=1 opts the ETL back in).
+
+CLI (from the repo root):
+    python -m scripts.integreat.schema status
+    python -m scripts.integreat.schema provision
+"""
+
+import sys
+import traceback
+import argparse
+from collections import namedtuple
+
+from sqlalchemy import text
+
+IndexSpec = namedtuple("IndexSpec", ["name", "table", "method", "definition", "options"])
+
+INDEXES = [
+    IndexSpec("ix_api_transactions_created_at", '"OLTP".api_transactions',
+              "brin", "(created_at)", "WITH (pages_per_range = 32)"),
+    IndexSpec("ix_fact_log_transactions_created_at", '"OLAP".fact_log_transactions',
+              "btree", "(created_at)", ""),
+    IndexSpec("ix_fact_log_transactions_time_id", '"OLAP".fact_log_transactions',
+              "btree", "(time_id)", ""),
+    IndexSpec("ix_fact_log_transactions_location_id", '"OLAP".fact_log_transactions',
+              "btree", "(location_id)", ""),
+    IndexSpec("ix_fact_log_transactions_user_id", '"OLAP".fact_log_transactions',
+              "btree", "(user_id)", ""),
+    IndexSpec("ix_fact_log_transactions_service_id", '"OLAP".fact_log_transactions',
+              "btree", "(service_id)", ""),
+    IndexSpec("ix_dim_user_origin_lower", '"OLAP".dim_user',
+              "btree", "(LOWER(origin))", ""),
+    IndexSpec("ix_dim_service_destination_lower", '"OLAP".dim_service',
+              "btree", "(LOWER(destination))", ""),
+]
+
+def mart_indexes(tenants):
+    """The per-tenant mart indexes (the mart tables are keyed by tenant)."""
+    return [
+        IndexSpec(f"ix_mart_{tenant}_created_at", f'"OLAP".mart_{tenant}',
+                  "btree", "(created_at)", "")
+        for tenant in tenants
+    ]
+
+def warehouse_indexes(tenants=()):
+    return INDEXES + mart_indexes(tenants)
+
+def _schema_of(table):
+    return table.split(".")[0].strip('"')
+
+def index_status(conn, spec):
+    """Return 'missing', 'valid', 'invalid', 'building', or 'no-table' for one index."""
+    if conn.execute(text("SELECT to_regclass(:t)"), {"t": spec.table}).scalar() is None:
+        return "no-table"
+    row = conn.execute(text("""
+        SELECT i.indisvalid,
+               EXISTS (SELECT 1 FROM pg_stat_progress_create_index p
+                        WHERE p.index_relid = i.indexrelid) AS building
+          FROM pg_index i
+          JOIN pg_class c     ON c.oid = i.indexrelid
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+         WHERE c.relname = :name AND n.nspname = :schema
+    """), {"name": spec.name, "schema": _schema_of(spec.table)}).first()
+    if row is None:
+        return "missing"
+    if row.indisvalid:
+        return "valid"
+    return "building" if row.building else "invalid"
+
+def provision_indexes(engine, tenants=(), concurrently=True):
+    """
+    Create every declared index (INDEXES plus the marts of `tenants`) that
+    is missing or invalid. Returns the names created.
+    CONCURRENTLY avoids blocking writers but cannot run inside a
+    transaction, so this uses an autocommit connection.
+    """
+    created = []
+    mode = "CONCURRENTLY " if concurrently else ""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for spec in warehouse_indexes(tenants):
+            status = index_status(conn, spec)
+            if status in ("valid", "no-table"):
+                continue
+            if status == "building":
+                print(f"[schema] {spec.name} is being built by another session; leaving it")
+                continue
+            qualified = f'"{_schema_of(spec.table)}".{spec.name}'
+            if status == "invalid":
+                print(f"[schema] rebuilding invalid index {spec.name}")
+                conn.execute(text(f"DROP INDEX {mode}IF EXISTS {qualified}"))
+            print(f"[schema] creating index {spec.name} on {spec.table}")
+            conn.execute(text(
+                f"CREATE INDEX {mode}IF NOT EXISTS {spec.name} "
+                f"ON {spec.table} USING {spec.method} {spec.definition} {spec.options}"
+            ))
+            created.append(spec.name)
+    return created
+
+def main(argv=None):
+    from scripts.integreat.integreat_pipeline import engine, define_tables, MART_TABLES
+
+    parser = argparse.ArgumentParser(description="Warehouse index provisioning")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="show which declared indexes exist")
+    provision = sub.add_parser("provision", help="create missing / rebuild invalid indexes")
+    provision.add_argument("--no-concurrently", action="store_true",
+                           help="plain CREATE INDEX (locks writes; fine on an idle database)")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        with engine.connect() as conn:
+            for spec in warehouse_indexes(MART_TABLES):
+                print(f"{index_status(conn, spec):<9} {spec.name:<40} {spec.method:<6} "
+                      f"{spec.table} {spec.definition}")
+        return 0
+
+    define_tables()
+    created = provision_indexes(engine, MART_TABLES, concurrently=not args.no_concurrently)
+    print(f"[schema] {len(created)} index(es) created")
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from integreat_analytics.nightly_dag import STAGES, TENANT_FAILED
+from integreat_analytics.template import tenant_handler_template as template
+from scripts.batch_export import handler as batch
+
+
+@pytest.fixture
+def exports(monkeypatch):
+    """Record export_and_upload calls; `failures[tenant]` makes its next N calls fail."""
+    calls, failures, delays = [], {}, []
+
+    def export_and_upload(date_str, tenant, run_id=None):
+        calls.append(tenant)
+        if failures.get(tenant, 0) > 0:
+            failures[tenant] -= 1
+            raise RuntimeError(f"{tenant} upload failed")
+        return 10
+
+    monkeypatch.setattr(template, "export_and_upload", export_and_upload)
+    return calls, failures, delays
+
+
+def test_only_failed_tenants_are_retried(exports):
+    calls, failures, delays = exports
+    failures["teleo"] = 2
+    results = template.export_tenants("2024-03-21", ["campus", "teleo"], retries=3,
+                                      sleep=delays.append)
+    assert results == {"campus": {"status": "ok", "rows": 10}, "teleo": {"status": "ok", "rows": 10}}
+    assert calls.count("campus") == 1
+    assert calls.count("teleo") == 3
+    assert delays == [STAGES["export"].delay(1), STAGES["export"].delay(2)]
+
+
+def test_empty_tenant_list_exports_nothing(exports):
+    calls, _, _ = exports
+    assert template.export_tenants("2024-03-21", []) == {}
+    assert calls == []
+
+
+def test_handler_skips_tenants_whose_mart_failed(exports, monkeypatch):
+    calls, _, delays = exports
+    monkeypatch.setattr(batch, "export_tenants",
+                        lambda *args, **kwargs: template.export_tenants(*args, sleep=delays.append,
+                                                                        **kwargs))
+    response = batch.handler({"date_str": "2024-03-21", "tenants": [TENANT_FAILED, "campus"]}, None)
+    assert response["body"] == {"campus": {"status": "ok", "rows": 10}}
+    assert calls == ["campus"]
+
+
+def test_handler_raises_when_a_tenant_keeps_failing(exports, monkeypatch):
+    calls, failures, delays = exports
+    failures["pillars"] = 100
+    monkeypatch.setattr(batch, "export_tenants",
+                        lambda *args, **kwargs: template.export_tenants(*args, sleep=delays.append,
+                                                                        **kwargs))
+    with pytest.raises(RuntimeError, match=r"Export failed for \['pillars'\]"):
+        batch.handler({"date_str": "2024-03-21", "tenants": ["campus", "pillars"]}, None)
+    assert calls.count("campus") == 1
+    assert calls.count("pillars") == STAGES["export"].retries + 1
+
+
+def test_partial_csv_is_removed_when_the_query_fails(monkeypatch):
+    from contextlib import contextmanager
+    from sqlalchemy import Column, DateTime, MetaData, Table
+
+    mart = Table("mart_campus", MetaData(), Column("created_at", DateTime))
+    csv_path = "/tmp/campus_2099-01-01.csv"
+
+    class Result:
+        def keys(self):
+            return ["created_at"]
+
+        def partitions(self):
+            yield [("2099-01-01 00:00:00",)]
+            raise RuntimeError("connection lost mid-stream")
+
+    class Conn:
+        def execution_options(self, **options):
+            return self
+
+        def execute(self, query):
+            return Result()
+
+    class Engine:
+        @contextmanager
+        def connect(self):
+            yield Conn()
+
+    monkeypatch.setattr(template, "get_tenant_mart", lambda tenant: mart)
+    monkeypatch.setattr(template, "engine", Engine())
+    with pytest.raises(RuntimeError, match="connection lost"):
+        template.export_and_upload("2099-01-01", "campus")
+    assert not os.path.exists(csv_path)
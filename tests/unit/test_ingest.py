@@ -0,0 +1,142 @@
+import csv
+import io
+import sys
+
+import pytest
+
+from scripts.integreat.ingest import COLUMNS, NULL, encode_record, _read_records
+
+
+def _record(**overrides):
+    record = {
+        "log_id": 1,
+        "created_at": "2024-03-21T10:15:00Z",
+        "country": "Philippines",
+        "region": "NCR",
+        "city": "Manila",
+        "zip_code": "1000",
+        "latitude": 14.6,
+        "longitude": 120.98,
+        "destination": "Teleo",
+        "api_version": "v1",
+    }
+    record.update(overrides)
+    return record
+
+
+def _fields(line):
+    """Parse an encoded line back the way COPY (FORMAT csv) would."""
+    assert line.endswith("\n")
+    return dict(zip([name for name, _, _ in COLUMNS], next(csv.reader([line[:-1]]))))
+
+
+def test_encodes_one_line_per_record_in_column_order():
+    line = encode_record(_record())
+    fields = _fields(line)
+    assert line.count("\n") == 1
+    assert fields["log_id"] == "1"
+    assert fields["created_at"] == "2024-03-21 10:15:00"
+    assert fields["country"] == "Philippines"
+    assert fields["latitude"] == "14.6"
+
+
+def test_text_fields_are_quoted_and_escaped():
+    line = encode_record(_record(request_body='say "hi", then\nleave'))
+    assert '"say ""hi"", then\nleave"' in line
+    assert _fields(line)["request_body"] == 'say "hi", then\nleave'
+
+
+def test_missing_optional_value_is_unquoted_null():
+    line = encode_record(_record(role=None, origin=""))
+    raw = line.rstrip("\n").split(",")
+    role_index = [name for name, _, _ in COLUMNS].index("role")
+    assert raw[role_index] == NULL
+
+
+def test_literal_backslash_n_text_stays_a_string():
+    line = encode_record(_record(role=NULL))
+    assert '"\\N"' in line
+
+
+@pytest.mark.parametrize("column", ["log_id", "created_at", "country", "destination", "api_version"])
+def test_required_columns_are_enforced(column):
+    with pytest.raises(ValueError, match=f"^{column}: missing required value"):
+        encode_record(_record(**{column: None}))
+
+
+@pytest.mark.parametrize("column,value", [
+    ("log_id", 2**31),
+    ("log_id", -2**31 - 1),
+    ("response_status_code", 99999999999),
+    ("execution_time_ms", "3000000000"),
+])
+def test_integers_outside_int4_are_rejected(column, value):
+    with pytest.raises(ValueError, match=f"^{column}: .*out of range"):
+        encode_record(_record(**{column: value}))
+
+
+def test_integral_floats_are_accepted():
+    assert _fields(encode_record(_record(log_id=12.0, execution_time_ms="7.0")))["log_id"] == "12"
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("2024-03-21T10:15:00", "2024-03-21 10:15:00"),
+    ("2024-03-21 10:15", "2024-03-21 10:15:00"),
+    ("2024-03-21T18:15:00+08:00", "2024-03-21 10:15:00"),
+    # ISO week dates only parse on Python 3.11+, and Postgres would reject them raw
+    pytest.param("2024-W12-4", "2024-03-21 00:00:00",
+                 marks=pytest.mark.skipif(sys.version_info < (3, 11), reason="Python 3.11+ syntax")),
+    (1711016100, "2024-03-21 10:15:00"),
+])
+def test_timestamps_are_reemitted_in_postgres_form(value, expected):
+    assert _fields(encode_record(_record(created_at=value)))["created_at"] == expected
+
+
+def test_int4_bounds_are_accepted():
+    fields = _fields(encode_record(_record(log_id=2**31 - 1, execution_time_ms=-2**31)))
+    assert fields["log_id"] == str(2**31 - 1)
+    assert fields["execution_time_ms"] == str(-2**31)
+
+
+@pytest.mark.parametrize("overrides,message", [
+    ({"log_id": "12.5"}, "log_id: "),
+    ({"log_id": 12.5}, "log_id: 12.5 is not an integer"),
+    ({"log_id": float("inf")}, "log_id: "),
+    ({"log_id": True}, "log_id: boolean"),
+    ({"latitude": "nan"}, "latitude: "),
+    ({"created_at": "yesterday"}, "created_at: "),
+    ({"zip_code": "x" * 21}, "zip_code: longer than 20"),
+    ({"request_url": "a\x00b"}, "request_url: contains a NUL"),
+])
+def test_invalid_values_name_the_column(overrides, message):
+    with pytest.raises(ValueError, match=f"^{message}"):
+        encode_record(_record(**overrides))
+
+
+def test_non_object_record_is_rejected():
+    with pytest.raises(ValueError, match="not an object"):
+        encode_record([1, 2, 3])
+
+
+def test_ndjson_reader_reports_bad_json_and_skips_blank_lines():
+    stream = io.StringIO('{"log_id": 1}\n\n{not json}\n')
+    rows = list(_read_records(stream, "ndjson"))
+    assert [line_no for line_no, _, _ in rows] == [1, 3]
+    assert rows[0][1] == {"log_id": 1}
+    assert isinstance(rows[1][1], ValueError)
+    assert "invalid JSON" in str(rows[1][1])
+    assert rows[1][2] == "{not json}\n"
+
+
+def test_csv_reader_flags_rows_with_extra_fields():
+    stream = io.StringIO("log_id,country\n1,PH\n2,PH,extra\n")
+    rows = list(_read_records(stream, "csv"))
+    assert rows[0][1] == {"log_id": "1", "country": "PH"}
+    assert isinstance(rows[1][1], ValueError)
+    assert "more fields than the header" in str(rows[1][1])
+    assert rows[1][0] == 3
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError, match="Unsupported format"):
+        list(_read_records(io.StringIO(""), "xml"))
@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from integreat_analytics.metrics import Metrics
+from integreat_analytics.nightly_dag import STAGES, StageSpec, Task, build_dag, validate
+from scripts.integreat.orchestrator import run_dag
+
+
+def _runners(fail=(), flaky=None):
+    """Runners that fail for task names in `fail`, and `flaky[name]` times before succeeding."""
+    flaky = dict(flaky or {})
+    calls = []
+    lock = threading.Lock()
+
+    def run(task):
+        with lock:
+            calls.append(task.name)
+            if flaky.get(task.name, 0) > 0:
+                flaky[task.name] -= 1
+                raise RuntimeError(f"{task.name} flaked")
+        if task.name in fail:
+            raise RuntimeError(f"{task.name} broke")
+        return 1
+
+    return {kind: run for kind in STAGES}, calls
+
+
+def _run(tasks, runners, **kwargs):
+    delays = []
+    results = run_dag(tasks, runners, metrics=Metrics("test"), sleep=delays.append, **kwargs)
+    return results, delays
+
+
+def test_all_tasks_succeed_in_order():
+    runners, calls = _runners()
+    results, delays = _run(build_dag(("a", "b")), runners, max_concurrency=1)
+    assert all(r["status"] == "ok" and r["attempts"] == 1 for r in results.values())
+    assert calls == ["etl", "mart:a", "export:a", "mart:b", "export:b"]
+    assert delays == []
+
+
+def test_retries_with_exponential_backoff():
+    runners, _ = _runners(flaky={"etl": 2})
+    results, delays = _run(build_dag(("a",)), runners)
+    assert results["etl"]["status"] == "ok"
+    assert results["etl"]["attempts"] == 3
+    spec = STAGES["etl"]
+    assert delays == [spec.backoff_seconds, spec.backoff_seconds * spec.backoff_rate]
+
+
+def test_task_fails_once_retries_are_exhausted():
+    runners, calls = _runners(fail={"mart:a"})
+    results, delays = _run(build_dag(("a",)), runners)
+    assert results["mart:a"]["status"] == "failed"
+    assert results["mart:a"]["attempts"] == STAGES["mart"].retries + 1
+    assert "mart:a broke" in results["mart:a"]["error"]
+    assert len(delays) == STAGES["mart"].retries
+    assert calls.count("mart:a") == STAGES["mart"].retries + 1
+
+
+def test_failed_task_skips_only_its_dependents():
+    runners, calls = _runners(fail={"mart:a"})
+    results, _ = _run(build_dag(("a", "b")), runners)
+    assert results["export:a"]["status"] == "skipped"
+    assert results["mart:b"]["status"] == "ok"
+    assert results["export:b"]["status"] == "ok"
+    assert "export:a" not in calls
+
+
+def test_failed_root_skips_everything_in_any_task_order():
+    runners, calls = _runners(fail={"etl"})
+    tasks = list(reversed(build_dag(("a", "b"))))
+    results, _ = _run(tasks, runners)
+    assert list(results) == [t.name for t in tasks]
+    assert results["etl"]["status"] == "failed"
+    assert {name for name, r in results.items() if r["status"] == "skipped"} == {
+        "mart:a", "export:a", "mart:b", "export:b"}
+    assert set(calls) == {"etl"}
+
+
+def test_concurrency_limit_is_respected():
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def run(task):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+        return 1
+
+    tasks = build_dag(("a", "b", "c", "d"))
+    results, _ = _run(tasks, {kind: run for kind in STAGES}, max_concurrency=2)
+    assert all(r["status"] == "ok" for r in results.values())
+    assert state["peak"] == 2
+
+
+def test_stage_spec_delay():
+    spec = StageSpec("x", backoff_seconds=10, backoff_rate=3)
+    assert [spec.delay(n) for n in (1, 2, 3)] == [10, 30, 90]
+
+
+def test_validate_returns_dependency_order():
+    tasks = build_dag(("a", "b"))
+    assert validate(tasks) == tasks
+    ordered = [t.name for t in validate(list(reversed(tasks)))]
+    assert ordered == ["etl", "mart:b", "export:b", "mart:a", "export:a"]
+
+
+def test_validate_rejects_cycles():
+    spec = STAGES["mart"]
+    tasks = [Task("x", spec, depends_on=("y",)), Task("y", spec, depends_on=("x",)),
+             Task("z", spec)]
+    with pytest.raises(ValueError, match=r"Cycle among tasks \['x', 'y'\]"):
+        validate(tasks)
+
+
+def test_validate_rejects_unknown_dependencies():
+    tasks = build_dag(("a",)) + [Task("export:b", STAGES["export"], "b", ("mart:b",))]
+    with pytest.raises(ValueError, match=r"export:b depends on unknown task\(s\) \['mart:b'\]"):
+        validate(tasks)
+
+
+def test_validate_rejects_duplicate_names():
+    with pytest.raises(ValueError, match="Duplicate"):
+        validate(build_dag(("a",)) + [Task("etl", STAGES["etl"])])
+
+
+@pytest.mark.parametrize("tenants", ["teleo,acme", "mart_teleo; DROP TABLE x", ","])
+def test_cli_rejects_unknown_tenants_before_running(tenants, monkeypatch):
+    from scripts.integreat import orchestrator
+
+    monkeypatch.setattr(orchestrator, "local_runners", lambda *args: pytest.fail("runners built"))
+    with pytest.raises(SystemExit) as exit_info:
+        orchestrator.main(["2024-03-21", "--tenants", tenants])
+    assert exit_info.value.code == 2
@@ -0,0 +1,58 @@
+from scripts.integreat.plan_capture import (
+    diff_plans, is_write, plan_summary, select_for_explain, statement_hash,
+)
+
+WRITE_PLAN = {"Plan": {"Node Type": "ModifyTable", "Total Cost": 120.5, "Plan Rows": 10, "Plans": [
+    {"Node Type": "Index Scan", "Index Name": "ix_api_transactions_created_at",
+     "Total Cost": 100.0, "Plan Rows": 10},
+]}}
+
+READ_PLAN = {"Planning Time": 0.2, "Execution Time": 12.5, "Plan": {
+    "Node Type": "Seq Scan", "Relation Name": "mart_teleo", "Total Cost": 50.0, "Plan Rows": 90,
+    "Actual Rows": 100, "Shared Hit Blocks": 7, "Shared Read Blocks": 3,
+}}
+
+
+def test_writes_are_detected_including_data_modifying_ctes():
+    assert is_write("INSERT INTO t SELECT 1")
+    assert is_write("  delete from t")
+    assert is_write("WITH d AS (DELETE FROM t RETURNING *) INSERT INTO u SELECT * FROM d")
+    assert not is_write("WITH x AS (SELECT 1) SELECT * FROM x")
+    assert not is_write("SELECT updated_at FROM t")
+
+
+def test_select_for_explain_keeps_the_slowest_of_each_statement():
+    pending = [
+        {"statement": "INSERT INTO f SELECT 1", "observed_ms": 5},
+        {"statement": "INSERT  INTO f SELECT 1", "observed_ms": 9},
+        {"statement": "SELECT 2", "observed_ms": 7},
+        {"statement": "SELECT 3", "observed_ms": 1},
+    ]
+    selected = select_for_explain(pending, limit=2)
+    assert [item["observed_ms"] for item in selected] == [9, 7]
+    assert len({statement_hash(item["statement"]) for item in pending}) == 3
+
+
+def test_write_summary_has_estimates_only():
+    assert plan_summary(WRITE_PLAN) == {"total_cost": 120.5, "estimated_rows": 10, "seq_scans": 0}
+
+
+def test_read_summary_has_analyze_numbers():
+    summary = plan_summary(READ_PLAN)
+    assert summary["execution_ms"] == 12.5
+    assert summary["actual_rows"] == 100
+    assert summary["shared_read_blocks"] == 3
+    assert summary["seq_scans"] == 1
+
+
+def test_diff_of_writes_shows_observed_time_and_skips_empty_metrics():
+    lines = diff_plans(WRITE_PLAN, WRITE_PLAN, "a", "b", observed_a=100.0, observed_b=150.0)
+    assert lines[0].split() == ["observed_ms", "100.0", "->", "150.0", "(+50%)"]
+    assert not any("execution_ms" in line or "None" in line for line in lines)
+    assert lines[-1] == "  plan shape: unchanged"
+
+
+def test_diff_reports_a_changed_plan_shape():
+    lines = diff_plans(WRITE_PLAN, READ_PLAN)
+    assert "  plan shape: changed" in lines
+    assert any(line.strip().startswith("execution_ms") for line in lines)
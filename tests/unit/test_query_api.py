@@ -0,0 +1,202 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+from scripts.integreat import query_api
+from scripts.integreat.query_api import TTLCache, Query_Handler, normalize
+
+
+def _query(**overrides):
+    query = {"tenant": "teleo", "start": "2024-03-01", "end": "2024-03-08"}
+    query.update(overrides)
+    return query
+
+
+# --- normalize --------------------------------------------------------------
+
+def test_normalize_fills_defaults_and_canonicalizes():
+    q = normalize(_query(tenant="Teleo", end=None,
+                         filters={"role": ["b", "a"], "request_method": "GET"}))
+    assert q == {
+        "tenant": "teleo", "start": "2024-03-01T00:00:00", "end": "2024-03-02T00:00:00",
+        "group_by": [], "metrics": ["requests"],
+        "filters": {"request_method": ["GET"], "role": ["a", "b"]}, "limit": 1000,
+    }
+    assert list(q["filters"]) == ["request_method", "role"]
+
+
+def test_equivalent_queries_normalize_identically():
+    a = normalize(_query(filters={"role": ["x", "y"], "city": "Cebu"}, limit="50"))
+    b = normalize(_query(filters={"city": ["Cebu"], "role": ["y", "x"]}, limit=50))
+    assert json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+
+
+def test_normalize_converts_filter_values_to_column_types():
+    q = normalize(_query(filters={"country": 1, "city": ["Cebu", 2.5],
+                                  "response_status_code": ["404", 200, 500.0]}))
+    assert q["filters"] == {"city": ["2.5", "Cebu"], "country": ["1"],
+                            "response_status_code": [200, 404, 500]}
+
+
+def test_normalize_converts_offsets_to_naive_utc():
+    q = normalize(_query(start="2024-01-15T00:00:00+08:00", end="2024-01-16"))
+    assert (q["start"], q["end"]) == ("2024-01-14T16:00:00", "2024-01-16T00:00:00")
+    q = normalize(_query(start="2024-01-15T00:00:00+00:00", end=None))
+    assert (q["start"], q["end"]) == ("2024-01-15T00:00:00", "2024-01-16T00:00:00")
+
+
+@pytest.mark.parametrize("overrides,message", [
+    ({"tenant": "acme"}, "tenant"),
+    ({"start": "yesterday"}, "start"),
+    ({"end": "2024-02-01"}, "end must be after start"),
+    ({"end": "2026-01-01"}, "limited to"),
+    ({"group_by": ["day", "week"]}, "at most one"),
+    ({"group_by": ["country", "country"]}, "group_by"),
+    ({"group_by": ["password"]}, "group_by"),
+    ({"group_by": "day"}, "group_by: expected a list"),
+    ({"group_by": [["day"]]}, "group_by: expected a list"),
+    ({"metrics": ["sum_of_everything"]}, "metrics"),
+    ({"metrics": 5}, "metrics: expected a list"),
+    ({"filters": {"request_body": "x"}}, "filters: expected keys"),
+    ({"filters": ["role"]}, "filters: expected an object"),
+    ({"filters": {"role": {"$ne": "x"}}}, "filters.role"),
+    ({"filters": {"role": [["a"]]}}, "filters.role"),
+    ({"filters": {"role": []}}, "filters.role"),
+    ({"limit": -1}, "limit"),
+    ({"limit": 10**6}, "limit"),
+    ({"limit": [10]}, "limit"),
+    ({"limit": "ten"}, "limit"),
+    ({"filters": {"country": True}}, "filters.country"),
+    ({"filters": {"role": ["a", None]}}, "filters.role"),
+    ({"filters": {"response_status_code": "abc"}}, "filters.response_status_code: expected an integer"),
+    ({"filters": {"response_status_code": [200, 404.5]}}, "filters.response_status_code"),
+    ({"filters": {"response_status_code": False}}, "filters.response_status_code"),
+    ({"start": "2024-03-08T00:00:00+08:00", "end": "2024-03-07T15:00:00"}, "end must be after start"),
+])
+def test_normalize_rejects_invalid_queries(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        normalize(_query(**overrides))
+
+
+@pytest.mark.parametrize("query", [[1], "teleo", None, 5])
+def test_normalize_rejects_non_objects(query):
+    with pytest.raises(ValueError, match="expected a JSON object"):
+        normalize(query)
+
+
+# --- TTLCache ---------------------------------------------------------------
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_api, "monotonic", lambda: now[0])
+    return now
+
+
+def test_cache_entries_expire(clock):
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("k", "v")
+    clock[0] += 9.9
+    assert cache.get("k") == "v"
+    clock[0] += 0.1
+    assert cache.get("k") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a is now the most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+# --- run_query cache key ----------------------------------------------------
+
+class _FakeRows:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def keys(self):
+        return ["requests"]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class _FakeEngine:
+    def __init__(self):
+        self.executed = 0
+
+    @contextmanager
+    def connect(self):
+        engine = self
+
+        class _Conn:
+            def execute(self, statement):
+                engine.executed += 1
+                return _FakeRows([[engine.executed]])
+
+        yield _Conn()
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    engine, marks = _FakeEngine(), {"teleo": "nightly-2024-03-07@t1"}
+    monkeypatch.setattr(query_api, "engine", engine)
+    monkeypatch.setattr(query_api, "build_statement", lambda q: "SELECT 1")
+    monkeypatch.setattr(query_api, "watermark", lambda tenant: marks[tenant])
+    monkeypatch.setattr(query_api, "RESULTS", TTLCache(16, 60))
+    return engine, marks
+
+
+def test_results_are_cached_until_the_watermark_moves(fake_db):
+    engine, marks = fake_db
+    first = query_api.run_query(_query())
+    second = query_api.run_query(_query())
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert second["rows"] == first["rows"] == [[1]]
+    assert engine.executed == 1
+
+    marks["teleo"] = "nightly-2024-03-08@t2"
+    third = query_api.run_query(_query())
+    assert third["cached"] is False
+    assert third["rows"] == [[2]]
+    assert third["watermark"] == "nightly-2024-03-08@t2"
+
+
+# --- Query_Handler ----------------------------------------------------------
+
+def _api_event(body, tenant_claim="teleo"):
+    claims = {"custom:tenant": tenant_claim} if tenant_claim else {}
+    return {"body": body if isinstance(body, str) else json.dumps(body),
+            "requestContext": {"authorizer": {"claims": claims}}}
+
+
+def test_handler_refuses_another_tenant():
+    response = Query_Handler(_api_event(_query(tenant="campus")), None)
+    assert response["statusCode"] == 403
+    assert "does not match" in json.loads(response["body"])["error"]
+
+
+def test_handler_requires_a_tenant_claim_behind_the_api():
+    response = Query_Handler(_api_event(_query(), tenant_claim=None), None)
+    assert response["statusCode"] == 403
+    assert "no tenant claim" in json.loads(response["body"])["error"]
+
+
+@pytest.mark.parametrize("body", ["[1]", '"teleo"', "not json", '{"start": "2024-03-01", "filters": {"role": {"a": 1}}}',
+                                  '{"start": "2024-03-01", "filters": {"response_status_code": "abc"}}'])
+def test_handler_rejects_malformed_bodies(body):
+    response = Query_Handler(_api_event(body), None)
+    assert response["statusCode"] == 400
+
+
+def test_handler_uses_the_claimed_tenant(fake_db):
+    response = Query_Handler(_api_event({"start": "2024-03-01"}, tenant_claim="Teleo"), None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["rows"] == [[1]]